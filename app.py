@@ -1,25 +1,242 @@
 # carwash_server.py
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+import bisect
+import collections
+import gzip
+import click
+from contextlib import contextmanager
+import hashlib
+import csv
+from html import escape
 import json
-from flask import Flask, request, jsonify, render_template, send_from_directory, abort, send_file
+from flask import Flask, request, jsonify, render_template, send_from_directory, abort, send_file, Response, stream_with_context, g, has_request_context
 import io
-from openpyxl import Workbook
+import tempfile
+import zipfile
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.engine import Engine
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from flask_cors import CORS
 from flask import redirect, url_for
 import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+import zlib
 
 BASEDIR = os.path.abspath(os.path.dirname(__file__))
 # Use instance folder for database (Flask convention)
 INSTANCE_PATH = os.path.join(BASEDIR, 'instance')
 os.makedirs(INSTANCE_PATH, exist_ok=True)
-DB_PATH = os.path.join(INSTANCE_PATH, 'carwash.db')
+DB_PATH = os.getenv('CARWASH_DB_PATH') or os.path.join(INSTANCE_PATH, 'carwash.db')
+ARCHIVE_PATH = os.getenv('CARWASH_ARCHIVE_PATH') or os.path.join(os.path.dirname(DB_PATH), 'carwash_archive.db')
 
 app = Flask(__name__, static_folder='static', template_folder='static')
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + DB_PATH
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db = SQLAlchemy(app)
-CORS(app, resources={r"/api/*": {"origins": "*"}})
+
+# Connection tuning applied to every new SQLite connection. WAL lets the dashboard
+# and exports read while a checkout is writing; NORMAL sync is durable in WAL mode
+# except for the last transactions on power loss.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': int(os.getenv('CARWASH_SQLITE_BUSY_TIMEOUT_MS', 5000)),
+    'cache_size': -int(os.getenv('CARWASH_SQLITE_CACHE_KB', 20000)),  # negative = KiB
+    'mmap_size': int(os.getenv('CARWASH_SQLITE_MMAP_BYTES', 256 * 1024 * 1024)),
+    'temp_store': 'MEMORY',
+}
+
+@event.listens_for(Engine, 'connect')
+def _set_sqlite_pragmas(dbapi_conn, connection_record):
+    if not isinstance(dbapi_conn, sqlite3.Connection):
+        return
+    cur = dbapi_conn.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cur.execute(f'PRAGMA {name}={value}')
+    cur.close()
+
+CORS(app, resources={r"/api/*": {"origins": "*"}}, expose_headers=['X-Next-Cursor', 'Server-Timing'])
+
+# --- JSON encoding and response compression ---
+# orjson and brotli are optional: with orjson installed jsonify() and the streamed
+# list endpoints encode several times faster (same output), and brotli is offered
+# to clients that accept it. Without them the stdlib encoder and gzip are used.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.getenv('CARWASH_COMPRESS_MIN_BYTES', 1024))
+COMPRESS_LEVEL = int(os.getenv('CARWASH_COMPRESS_LEVEL', 6))  # gzip level; brotli uses quality 5
+COMPRESSIBLE_TYPES = {'application/json', 'application/x-ndjson', 'text/html', 'text/plain', 'text/csv', 'text/css', 'application/javascript'}
+
+def json_bytes(obj):
+    """Compact JSON encoding as bytes, through orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, separators=(',', ':')).encode()
+
+if orjson is not None:
+    try:
+        from flask.json.provider import DefaultJSONProvider
+    except ImportError:  # Flask < 2.2 has no pluggable provider; keep the default
+        DefaultJSONProvider = None
+    if DefaultJSONProvider is not None:
+        class OrjsonProvider(DefaultJSONProvider):
+            """jsonify() through orjson, producing the same JSON as the default provider."""
+            def dumps(self, obj, **kwargs):
+                option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME  # dates go through Flask's default()
+                if kwargs.get('sort_keys', self.sort_keys):
+                    option |= orjson.OPT_SORT_KEYS
+                try:
+                    return orjson.dumps(obj, default=kwargs.get('default', self.default), option=option).decode()
+                except TypeError:  # e.g. integers beyond 64 bits
+                    return super().dumps(obj, **kwargs)
+        app.json = OrjsonProvider(app)
+
+def response_encoding():
+    """Best Content-Encoding the client accepts (br, then gzip), or None."""
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+def compress_stream(chunks, encoding):
+    """Compress a streamed body chunk by chunk, flushing so each chunk reaches the client."""
+    if encoding == 'br':
+        comp = brotli.Compressor(quality=5)
+        process, flush, finish = comp.process, comp.flush, comp.finish
+    else:
+        comp = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+        process, flush, finish = comp.compress, lambda: comp.flush(zlib.Z_SYNC_FLUSH), comp.flush
+    for chunk in chunks:
+        if chunk:
+            yield process(chunk.encode() if isinstance(chunk, str) else chunk) + flush()
+    yield finish()
+
+@app.after_request
+def compress_response(resp):
+    if (not 200 <= resp.status_code < 300 or resp.status_code == 204 or request.method == 'HEAD'
+            or resp.mimetype not in COMPRESSIBLE_TYPES or 'Content-Encoding' in resp.headers or resp.direct_passthrough):
+        return resp
+    resp.vary.add('Accept-Encoding')
+    encoding = response_encoding()
+    if encoding is None:
+        return resp
+    if resp.is_streamed:
+        if hasattr(resp.response, 'close'):
+            resp.call_on_close(resp.response.close)  # also when the wrapper below is never started
+        resp.response = compress_stream(resp.response, encoding)
+        resp.headers.pop('Content-Length', None)
+    else:
+        data = resp.get_data()
+        if len(data) < COMPRESS_MIN_BYTES:
+            return resp
+        resp.set_data(brotli.compress(data, quality=5) if encoding == 'br' else gzip.compress(data, COMPRESS_LEVEL))
+    resp.headers['Content-Encoding'] = encoding
+    return resp
+
+# --- Instrumentation: per-endpoint latency, SQL counts/time, slow queries ---
+# Kept per process in plain dicts under one lock; exposed as Prometheus text on /metrics.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_QUERY_MS = float(os.getenv('CARWASH_SLOW_QUERY_MS', 200))
+SERVER_TIMING = os.getenv('CARWASH_SERVER_TIMING', 'False').lower() == 'true'
+_metrics_lock = threading.Lock()
+_request_counts = {}    # (endpoint, method, status) -> count
+_latency_hist = {}      # endpoint -> [bucket counts..., +Inf count, sum seconds]
+_sql_totals = {}        # endpoint -> [statements, seconds]
+_slow_queries = [0]
+
+def _endpoint_label():
+    rule = request.url_rule
+    return rule.rule if rule is not None else 'unmatched'
+
+@app.before_request
+def _start_request_timer():
+    g.request_start = time.perf_counter()
+    g.sql_count = 0
+    g.sql_time = 0.0
+
+@app.after_request
+def _record_request_metrics(response):
+    start = g.get('request_start')
+    if start is None:
+        return response
+    elapsed = time.perf_counter() - start
+    endpoint = _endpoint_label()
+    with _metrics_lock:
+        key = (endpoint, request.method, response.status_code)
+        _request_counts[key] = _request_counts.get(key, 0) + 1
+        hist = _latency_hist.setdefault(endpoint, [0] * (len(LATENCY_BUCKETS) + 2))
+        hist[bisect.bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+        hist[-1] += elapsed
+        sql = _sql_totals.setdefault(endpoint, [0, 0.0])
+        sql[0] += g.sql_count
+        sql[1] += g.sql_time
+    if SERVER_TIMING:
+        response.headers['Server-Timing'] = f'app;dur={elapsed * 1000:.1f}, db;dur={g.sql_time * 1000:.1f};desc="{g.sql_count} queries"'
+    return response
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    # kept on the execution context, which is discarded when a statement fails
+    context._query_start = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _record_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._query_start
+    if has_request_context() and 'sql_count' in g:
+        g.sql_count += 1
+        g.sql_time += elapsed
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        with _metrics_lock:
+            _slow_queries[0] += 1
+        app.logger.warning('slow query (%.1f ms): %s', elapsed * 1000, ' '.join(statement.split())[:500])
+
+def render_metrics():
+    """Prometheus text exposition of the counters above."""
+    def esc(v):
+        return str(v).replace('\\', '\\\\').replace('"', '\\"')
+    lines = [
+        '# HELP carwash_http_requests_total HTTP requests by endpoint, method and status.',
+        '# TYPE carwash_http_requests_total counter',
+    ]
+    with _metrics_lock:
+        for (endpoint, method, status), n in sorted(_request_counts.items()):
+            lines.append(f'carwash_http_requests_total{{endpoint="{esc(endpoint)}",method="{method}",status="{status}"}} {n}')
+        lines += ['# HELP carwash_http_request_duration_seconds Request latency up to the response headers.',
+                  '# TYPE carwash_http_request_duration_seconds histogram']
+        for endpoint, hist in sorted(_latency_hist.items()):
+            label = f'endpoint="{esc(endpoint)}"'
+            cumulative = 0
+            for bound, n in zip(LATENCY_BUCKETS + ('+Inf',), hist[:-1]):
+                cumulative += n
+                lines.append(f'carwash_http_request_duration_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'carwash_http_request_duration_seconds_sum{{{label}}} {hist[-1]:.6f}')
+            lines.append(f'carwash_http_request_duration_seconds_count{{{label}}} {cumulative}')
+        lines += ['# HELP carwash_sql_statements_total SQL statements executed while serving an endpoint.',
+                  '# TYPE carwash_sql_statements_total counter']
+        lines += [f'carwash_sql_statements_total{{endpoint="{esc(e)}"}} {s[0]}' for e, s in sorted(_sql_totals.items())]
+        lines += ['# HELP carwash_sql_duration_seconds_total Time spent in SQL while serving an endpoint.',
+                  '# TYPE carwash_sql_duration_seconds_total counter']
+        lines += [f'carwash_sql_duration_seconds_total{{endpoint="{esc(e)}"}} {s[1]:.6f}' for e, s in sorted(_sql_totals.items())]
+        lines += ['# HELP carwash_slow_queries_total SQL statements slower than CARWASH_SLOW_QUERY_MS.',
+                  '# TYPE carwash_slow_queries_total counter',
+                  f'carwash_slow_queries_total {_slow_queries[0]}']
+    return '\n'.join(lines) + '\n'
 
 # Models
 class Customer(db.Model):
@@ -28,33 +245,39 @@ class Customer(db.Model):
     phone = db.Column(db.String(30))
     email = db.Column(db.String(120))
     vehicles = db.relationship('Vehicle', backref='owner', cascade='all,delete-orphan')
+    __table_args__ = (
+        db.Index('ix_customer_name_phone', 'name', 'phone'),  # find-or-create in /api/sale
+    )
 
 class Vehicle(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     reg_no = db.Column(db.String(80), nullable=False, unique=True)
     model = db.Column(db.String(120))
-    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'))
+    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'), index=True)
 
 class Service(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False)
     price = db.Column(db.Float, nullable=False)
+    duration_min = db.Column(db.Integer, nullable=False, default=30, server_default='30')  # bay time per booking
 
 class Appointment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id'), nullable=False)
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id'), nullable=False, index=True)
     service_id = db.Column(db.Integer, db.ForeignKey('service.id'), nullable=False)
-    scheduled_at = db.Column(db.DateTime, nullable=False)
+    scheduled_at = db.Column(db.DateTime, nullable=False, index=True)
     status = db.Column(db.String(30), default='scheduled')  # scheduled/done/cancelled
     paid = db.Column(db.Boolean, default=False)
     service = db.relationship('Service')
+    vehicle = db.relationship('Vehicle')
 
 class Payment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     appointment_id = db.Column(db.Integer, db.ForeignKey('appointment.id'), nullable=True)
     amount = db.Column(db.Float, nullable=False)
     method = db.Column(db.String(30), default='cash')
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    appointment = db.relationship('Appointment')
 
 # POS Sale / SaleItem
 class Sale(db.Model):
@@ -65,20 +288,420 @@ class Sale(db.Model):
     paid = db.Column(db.Boolean, default=True)
     method = db.Column(db.String(30), default='cash')
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    client_ref = db.Column(db.String(64))  # client-supplied idempotency key (e.g. offline id s_xxx)
     items = db.relationship('SaleItem', backref='sale', cascade='all,delete-orphan')
+    customer = db.relationship('Customer')
+    vehicle = db.relationship('Vehicle')
+    __table_args__ = (
+        # keyset pagination and the filters of GET /api/sales
+        db.Index('ix_sale_timestamp_id', 'timestamp', 'id'),
+        db.Index('ix_sale_customer_timestamp', 'customer_id', 'timestamp'),
+        db.Index('ix_sale_method_timestamp', 'method', 'timestamp'),
+        db.Index('ux_sale_client_ref', 'client_ref', unique=True),
+    )
 
 class SaleItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    sale_id = db.Column(db.Integer, db.ForeignKey('sale.id'), nullable=False)
+    sale_id = db.Column(db.Integer, db.ForeignKey('sale.id'), nullable=False, index=True)
     service_id = db.Column(db.Integer, db.ForeignKey('service.id'), nullable=False)
     qty = db.Column(db.Integer, nullable=False)
     price = db.Column(db.Float, nullable=False)
     line_total = db.Column(db.Float, nullable=False)
     service = db.relationship('Service')
 
+# Pre-aggregated sales per day, kept up to date in the same transaction as each sale.
+# dim='total' (key ''), dim='method' (key = payment method) or dim='service' (key = service id);
+# for service rows sale_count counts sale lines.
+class DailySalesRollup(db.Model):
+    __tablename__ = 'daily_sales_rollup'
+    day = db.Column(db.Date, primary_key=True)
+    dim = db.Column(db.String(10), primary_key=True)
+    key = db.Column(db.String(60), primary_key=True, default='')
+    sale_count = db.Column(db.Integer, nullable=False, default=0)
+    qty = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+
+def sale_rollup_rows(timestamp, method, total, lines):
+    """Rollup increments for one sale; lines are (service_id, qty, line_total)."""
+    day = timestamp.date()
+    rows = [
+        {'day': day, 'dim': 'total', 'key': '', 'sale_count': 1, 'qty': sum(qty for _, qty, _ in lines), 'revenue': total},
+        {'day': day, 'dim': 'method', 'key': method or '', 'sale_count': 1, 'qty': 0, 'revenue': total},
+    ]
+    for service_id, qty, line_total in lines:
+        rows.append({'day': day, 'dim': 'service', 'key': str(service_id), 'sale_count': 1, 'qty': qty, 'revenue': line_total})
+    return rows
+
+def record_sale_rollup(sale):
+    """Add a pending sale (with its items) to the daily rollup; the caller commits."""
+    apply_rollup(sale_rollup_rows(sale.timestamp, sale.method, sale.total, [(it.service_id, it.qty, it.line_total) for it in sale.items]))
+
+def apply_rollup(rows):
+    """Upsert rollup increments with one executemany statement."""
+    if not rows:
+        return
+    t = DailySalesRollup.__table__
+    stmt = sqlite_insert(t)
+    stmt = stmt.on_conflict_do_update(index_elements=[t.c.day, t.c.dim, t.c.key], set_={
+        'sale_count': t.c.sale_count + stmt.excluded.sale_count,
+        'qty': t.c.qty + stmt.excluded.qty,
+        'revenue': t.c.revenue + stmt.excluded.revenue,
+    })
+    db.session.execute(stmt, rows)
+
+ROLLUP_COLUMNS = ['day', 'dim', 'key', 'sale_count', 'qty', 'revenue']
+
+def rollup_selects():
+    """The total / method / service aggregates over the sale tables, one select per dim."""
+    day = db.func.date(Sale.timestamp)
+    item_qty = db.select(SaleItem.sale_id, db.func.sum(SaleItem.qty).label('qty')).group_by(SaleItem.sale_id).subquery()
+    return [
+        db.select(day, db.literal('total'), db.literal(''), db.func.count(Sale.id), db.func.coalesce(db.func.sum(item_qty.c.qty), 0), db.func.coalesce(db.func.sum(Sale.total), 0.0))
+          .select_from(Sale).outerjoin(item_qty, item_qty.c.sale_id == Sale.id).group_by(day),
+        db.select(day, db.literal('method'), db.func.coalesce(Sale.method, ''), db.func.count(Sale.id), db.literal(0), db.func.coalesce(db.func.sum(Sale.total), 0.0))
+          .group_by(day, db.func.coalesce(Sale.method, '')),
+        db.select(day, db.literal('service'), db.cast(SaleItem.service_id, db.String), db.func.count(SaleItem.id), db.func.sum(SaleItem.qty), db.func.sum(SaleItem.line_total))
+          .select_from(SaleItem).join(Sale, Sale.id == SaleItem.sale_id).group_by(day, SaleItem.service_id),
+    ]
+
+def rebuild_sales_rollup():
+    """Recompute daily_sales_rollup from the sale tables (backfill / repair), archived sales included."""
+    t = DailySalesRollup.__table__
+    archived = archive_cutoff() is not None and attach_archive()  # ATTACH must precede the first write
+    db.session.execute(t.delete())
+    for sel in rollup_selects():
+        db.session.execute(t.insert().from_select(ROLLUP_COLUMNS, sel))
+    if archived:
+        for sel in rollup_selects():
+            rows = [dict(zip(ROLLUP_COLUMNS, row)) for row in db.session.execute(sel, execution_options=ARCHIVE_SCHEMA)]
+            for row in rows:
+                row['day'] = datetime.strptime(row['day'], '%Y-%m-%d').date()  # date() comes back as text
+            apply_rollup(rows)
+    db.session.commit()
+
+@app.cli.command('rebuild-rollup')
+def rebuild_rollup_command():
+    """Rebuild the daily sales rollup from the raw sale tables."""
+    rebuild_sales_rollup()
+    print(f'daily_sales_rollup rebuilt: {DailySalesRollup.query.count()} rows')
+
+# Change log feeding GET /api/sync. One row per insert/update/delete of a synced
+# table, written in the same flush as the change itself; the row id is the sync token.
+class ChangeLog(db.Model):
+    __tablename__ = 'change_log'
+    id = db.Column(db.Integer, primary_key=True)
+    table = db.Column(db.String(30), nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(10), nullable=False)  # upsert / delete
+    at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    __table_args__ = (
+        db.Index('ix_change_log_table_id', 'table', 'id'),  # per-table versions
+        {'sqlite_autoincrement': True},  # tokens must never be reused after pruning
+    )
+
+# Small key/value store for process-independent state (e.g. the archive cutoff).
+class Setting(db.Model):
+    __tablename__ = 'app_setting'
+    key = db.Column(db.String(60), primary_key=True)
+    value = db.Column(db.String(255))
+
+SYNC_TABLES = {'services': Service, 'customers': Customer, 'vehicles': Vehicle, 'sales': Sale}
+# appointments and payments are versioned (slot index, export cache) but not part of /api/sync
+_SYNC_NAMES = {model: name for name, model in SYNC_TABLES.items()}
+_SYNC_NAMES[Appointment] = 'appointments'
+_SYNC_NAMES[Payment] = 'payments'
+CHANGE_LOG_RETENTION_DAYS = int(os.getenv('CARWASH_CHANGE_LOG_DAYS', 30))
+
+def log_changes(table, row_ids, op='upsert', connection=None):
+    """Append change-log rows for writes that bypass the ORM session (bulk inserts)."""
+    rows = [{'table': table, 'row_id': rid, 'op': op, 'at': datetime.utcnow()} for rid in row_ids]
+    if rows:
+        (connection or db.session).execute(ChangeLog.__table__.insert(), rows)
+        db.session.info.setdefault('changed_tables', set()).add(table)
+
+@event.listens_for(Session, 'after_flush')
+def _track_changes(session, flush_context):
+    rows = []
+    for op, objs in (('upsert', session.new), ('upsert', session.dirty), ('delete', session.deleted)):
+        for obj in objs:
+            name = _SYNC_NAMES.get(type(obj))
+            if name and (op != 'upsert' or obj in session.new or session.is_modified(obj, include_collections=False)):
+                rows.append({'table': name, 'row_id': obj.id, 'op': op, 'at': datetime.utcnow()})
+    if rows:
+        session.connection().execute(ChangeLog.__table__.insert(), rows)
+        session.info.setdefault('changed_tables', set()).update(r['table'] for r in rows)
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed(session):
+    invalidate_tables(session.info.pop('changed_tables', ()))
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back(session):
+    session.info.pop('changed_tables', None)
+
+def prune_change_log(days=CHANGE_LOG_RETENTION_DAYS):
+    """Drop change-log rows older than `days`; clients with older tokens get a full resync.
+
+    The newest row of each table is kept so table versions never go backwards.
+    The highest pruned id is recorded as the `change_log_pruned` setting: a
+    token below it may have lost changes even if older rows survive.
+    """
+    latest = db.session.query(db.func.max(ChangeLog.id)).group_by(ChangeLog.table)
+    stale = ChangeLog.query.filter(ChangeLog.at < datetime.utcnow() - timedelta(days=days), ChangeLog.id.notin_(latest))
+    pruned = stale.with_entities(db.func.max(ChangeLog.id)).scalar()
+    if pruned is not None:
+        mark = db.session.get(Setting, 'change_log_pruned') or Setting(key='change_log_pruned', value='0')
+        mark.value = str(max(pruned, int(mark.value)))
+        db.session.add(mark)
+        stale.delete(synchronize_session=False)
+    db.session.commit()
+
+# init_db prunes at startup; long-running servers also prune once a day per process
+CHANGE_LOG_PRUNE_EVERY = 24 * 3600
+_next_change_log_prune = time.monotonic() + CHANGE_LOG_PRUNE_EVERY
+_change_log_prune_lock = threading.Lock()
+
+def _prune_change_log_in_background():
+    with app.app_context():
+        try:
+            prune_change_log()
+        except Exception:
+            app.logger.exception('change log pruning failed')
+
+@app.before_request
+def _prune_change_log_daily():
+    global _next_change_log_prune
+    if time.monotonic() < _next_change_log_prune or not _change_log_prune_lock.acquire(blocking=False):
+        return
+    try:
+        _next_change_log_prune = time.monotonic() + CHANGE_LOG_PRUNE_EVERY
+    finally:
+        _change_log_prune_lock.release()
+    threading.Thread(target=_prune_change_log_in_background, name='carwash-prune', daemon=True).start()
+
+def change_log_pruned():
+    """Highest change-log id removed by prune_change_log (0 when nothing was pruned)."""
+    value = db.session.query(Setting.value).filter(Setting.key == 'change_log_pruned').scalar()
+    return int(value) if value else 0
+
+# Table versions and the service catalog cache. A table's version is its newest
+# change-log id. Commits in this process invalidate it immediately; changes made
+# by other worker processes are picked up within TABLE_VERSION_TTL seconds.
+TABLE_VERSION_TTL = float(os.getenv('CARWASH_TABLE_VERSION_TTL', 5))
+_table_versions = {}  # table -> (version, monotonic time checked)
+_catalog = None       # (version, [service dicts], {id: price}, {id: duration_min})
+_catalog_lock = threading.Lock()
+
+def table_version(name):
+    cached = _table_versions.get(name)
+    now = time.monotonic()
+    if cached and now - cached[1] < TABLE_VERSION_TTL:
+        return cached[0]
+    version = db.session.query(db.func.max(ChangeLog.id)).filter(ChangeLog.table == name).scalar() or 0
+    _table_versions[name] = (version, now)
+    return version
+
+def invalidate_tables(names):
+    global _catalog, _dashboard_cache
+    for name in names:
+        _table_versions.pop(name, None)
+        if name == 'services':
+            _catalog = None
+    if names:
+        _dashboard_cache = None
+
+def service_catalog():
+    """Return (version, services, prices, durations) from the in-process catalog cache."""
+    global _catalog
+    version = table_version('services')
+    cat = _catalog
+    if cat is not None and cat[0] == version:
+        return cat
+    with _catalog_lock:
+        if _catalog is None or _catalog[0] != version:
+            rows = db.session.query(Service.id, Service.name, Service.price, Service.duration_min).order_by(Service.id).all()
+            _catalog = (version, [{'id': sid, 'name': name, 'price': price, 'duration_min': dur} for sid, name, price, dur in rows],
+                        {sid: price for sid, _, price, _ in rows}, {sid: dur for sid, _, _, dur in rows})
+        return _catalog
+
+def conditional_json(table, build):
+    """JSON response tagged with the table version; 304 when the client already has it.
+
+    build() returns the payload, or a ready (e.g. streamed) Response. The ETag is
+    weak so it stays valid whichever Content-Encoding the body is sent with.
+    """
+    etag = f'{table}-{table_version(table)}'
+    if request.if_none_match.contains_weak(etag):
+        resp = Response(status=304)
+    else:
+        body = build()
+        resp = body if isinstance(body, Response) else jsonify(body)
+    resp.set_etag(etag, weak=True)
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
+# Schema migrations for existing databases. db.create_all() only creates missing
+# tables, so anything added to an existing table goes here as a numbered step;
+# the applied version is kept in SQLite's PRAGMA user_version.
+def create_indexes(*names):
+    """Create the named model indexes if they don't exist yet."""
+    indexes = {idx.name: idx for table in db.metadata.tables.values() for idx in table.indexes}
+    for name in names:
+        indexes[name].create(db.engine, checkfirst=True)
+
+def add_column(column):
+    """ALTER TABLE ... ADD COLUMN for a model column missing from an existing table."""
+    table = column.table.name
+    with db.engine.begin() as conn:
+        existing = {row[1] for row in conn.exec_driver_sql(f'PRAGMA table_info("{table}")')}
+        if column.name not in existing:
+            ddl = f'ALTER TABLE "{table}" ADD COLUMN "{column.name}" {column.type.compile(dialect=conn.dialect)}'
+            if column.server_default is not None:
+                ddl += f' NOT NULL DEFAULT {column.server_default.arg}' if not column.nullable else f' DEFAULT {column.server_default.arg}'
+            conn.exec_driver_sql(ddl)
+
+def migrate_sale_client_ref():
+    add_column(Sale.__table__.c.client_ref)
+    create_indexes('ux_sale_client_ref')
+
+# Customer/vehicle search index (SQLite FTS5). One document per customer
+# (rowid = customer id, with the reg_no/model of all their vehicles) and one per
+# ownerless vehicle (rowid = -vehicle id). Triggers keep it in sync with every
+# write path, including bulk inserts that bypass the ORM.
+_SEARCH_DOC_CUSTOMER = '''
+    DELETE FROM search_index WHERE rowid = {id};
+    INSERT INTO search_index(rowid, name, phone, email, reg_no, model)
+        SELECT c.id, c.name, c.phone, c.email,
+               (SELECT group_concat(reg_no, ' ') FROM vehicle WHERE customer_id = c.id),
+               (SELECT group_concat(model, ' ') FROM vehicle WHERE customer_id = c.id)
+        FROM customer c WHERE c.id = {id};'''
+_SEARCH_DOC_VEHICLE = '''
+    DELETE FROM search_index WHERE rowid = -{id};
+    INSERT INTO search_index(rowid, reg_no, model)
+        SELECT -v.id, v.reg_no, v.model FROM vehicle v WHERE v.id = {id} AND v.customer_id IS NULL;'''
+SEARCH_TRIGGERS = {
+    'search_customer_ai': ('AFTER INSERT ON customer', _SEARCH_DOC_CUSTOMER.format(id='new.id')),
+    'search_customer_au': ('AFTER UPDATE ON customer', _SEARCH_DOC_CUSTOMER.format(id='old.id') + _SEARCH_DOC_CUSTOMER.format(id='new.id')),
+    'search_customer_ad': ('AFTER DELETE ON customer', 'DELETE FROM search_index WHERE rowid = old.id;'),
+    'search_vehicle_ai': ('AFTER INSERT ON vehicle', _SEARCH_DOC_CUSTOMER.format(id='new.customer_id') + _SEARCH_DOC_VEHICLE.format(id='new.id')),
+    'search_vehicle_au': ('AFTER UPDATE ON vehicle', _SEARCH_DOC_CUSTOMER.format(id='old.customer_id') + _SEARCH_DOC_CUSTOMER.format(id='new.customer_id')
+                          + _SEARCH_DOC_VEHICLE.format(id='old.id') + _SEARCH_DOC_VEHICLE.format(id='new.id')),
+    'search_vehicle_ad': ('AFTER DELETE ON vehicle', _SEARCH_DOC_CUSTOMER.format(id='old.customer_id') + 'DELETE FROM search_index WHERE rowid = -old.id;'),
+}
+
+def fts5_available():
+    with db.engine.connect() as conn:
+        return bool(conn.exec_driver_sql("SELECT sqlite_compileoption_used('ENABLE_FTS5')").scalar()) or \
+            conn.exec_driver_sql("SELECT count(*) FROM pragma_module_list WHERE name = 'fts5'").scalar() > 0
+
+def migrate_search_index():
+    if not fts5_available():
+        app.logger.warning('SQLite FTS5 is not available; /api/search falls back to prefix LIKE queries')
+        return
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql("CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+                             "name, phone, email, reg_no, model, tokenize='unicode61 remove_diacritics 2', prefix='2 3 4')")
+        for name, (when, body) in SEARCH_TRIGGERS.items():
+            conn.exec_driver_sql(f'CREATE TRIGGER IF NOT EXISTS {name} {when} BEGIN {body} END')
+        conn.exec_driver_sql('DELETE FROM search_index')
+        conn.exec_driver_sql('''INSERT INTO search_index(rowid, name, phone, email, reg_no, model)
+            SELECT c.id, c.name, c.phone, c.email, group_concat(v.reg_no, ' '), group_concat(v.model, ' ')
+            FROM customer c LEFT JOIN vehicle v ON v.customer_id = c.id GROUP BY c.id''')
+        conn.exec_driver_sql('''INSERT INTO search_index(rowid, reg_no, model)
+            SELECT -id, reg_no, model FROM vehicle WHERE customer_id IS NULL''')
+
+@contextmanager
+def bulk_search_index():
+    """Defer search indexing for an insert-only bulk load inside the current write transaction.
+
+    The triggers are dropped, and rows added in the block are indexed with a
+    few set-based statements before the triggers are restored. Both steps
+    are part of the transaction, so a rollback leaves the triggers in place.
+    """
+    conn = db.session.connection()
+    if not conn.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE name = 'search_index'").first():
+        yield
+        return
+    last_customer = conn.exec_driver_sql('SELECT coalesce(max(id), 0) FROM customer').scalar()
+    last_vehicle = conn.exec_driver_sql('SELECT coalesce(max(id), 0) FROM vehicle').scalar()
+    for name in SEARCH_TRIGGERS:
+        conn.exec_driver_sql(f'DROP TRIGGER IF EXISTS {name}')
+    yield
+    params = {'c': last_customer, 'v': last_vehicle}
+    owners = 'SELECT customer_id FROM vehicle WHERE id > :v AND customer_id IS NOT NULL'
+    db.session.execute(db.text(f'DELETE FROM search_index WHERE rowid > :c OR rowid < -:v OR rowid IN ({owners})'), params)
+    db.session.execute(db.text(f"""INSERT INTO search_index(rowid, name, phone, email, reg_no, model)
+        SELECT c.id, c.name, c.phone, c.email, group_concat(v.reg_no, ' '), group_concat(v.model, ' ')
+        FROM customer c LEFT JOIN vehicle v ON v.customer_id = c.id
+        WHERE c.id > :c OR c.id IN ({owners}) GROUP BY c.id"""), params)
+    db.session.execute(db.text("""INSERT INTO search_index(rowid, reg_no, model)
+        SELECT -id, reg_no, model FROM vehicle WHERE id > :v AND customer_id IS NULL"""), params)
+    for name, (when, body) in SEARCH_TRIGGERS.items():
+        conn.exec_driver_sql(f'CREATE TRIGGER {name} {when} BEGIN {body} END')
+
+def migrate_sale_appointments_to_shop_time():
+    """Move sale-created appointments written in UTC onto the shop clock.
+
+    Before appointment times became shop wall-clock time, POST /api/sale and
+    /api/sales stored the server's UTC time for the 'done' appointment they
+    created. Those are recognised by a sale (same vehicle) or payment stamped
+    within two minutes of them; bookings and explicit times are left alone.
+    """
+    appt = Appointment.__table__
+    near = '(abs(julianday({0}) - julianday(a.scheduled_at)) * 86400 < 120)'
+    ids = db.text(f"""SELECT a.id FROM appointment a WHERE a.status = 'done' AND (
+        EXISTS (SELECT 1 FROM sale s WHERE s.vehicle_id = a.vehicle_id AND {near.format('s.timestamp')})
+        OR EXISTS (SELECT 1 FROM payment p WHERE p.appointment_id = a.id AND {near.format('p.timestamp')}))""")
+    with db.engine.begin() as conn:
+        legacy = [row[0] for row in conn.execute(ids)]
+        for chunk in _in_chunks(legacy):
+            rows = conn.execute(db.select(appt.c.id, appt.c.scheduled_at).where(appt.c.id.in_(chunk))).all()
+            conn.execute(appt.update().where(appt.c.id == db.bindparam('appt_id')).values(scheduled_at=db.bindparam('shop_at')),
+                         [{'appt_id': appt_id, 'shop_at': shop_time(at)} for appt_id, at in rows])
+    if legacy:
+        app.logger.info('moved %d sale appointments from UTC to shop time', len(legacy))
+
+MIGRATIONS = [
+    (1, lambda: create_indexes(
+        'ix_customer_name_phone', 'ix_vehicle_customer_id',
+        'ix_sale_timestamp_id', 'ix_sale_customer_timestamp', 'ix_sale_method_timestamp', 'ix_sale_item_sale_id',
+        'ix_appointment_scheduled_at', 'ix_appointment_vehicle_id', 'ix_payment_timestamp')),
+    (2, migrate_sale_client_ref),
+    (3, lambda: create_indexes('ix_change_log_table_id')),
+    (4, migrate_search_index),
+    (5, lambda: add_column(Service.__table__.c.duration_min)),
+    (6, lambda: Setting.__table__.create(db.engine, checkfirst=True)),
+    (7, migrate_sale_appointments_to_shop_time),
+]
+
+def schema_version():
+    with db.engine.connect() as conn:
+        return conn.exec_driver_sql('PRAGMA user_version').scalar()
+
+def schema_is_current():
+    """True when every model table exists and all migrations have been applied."""
+    with db.engine.connect() as conn:
+        tables = {row[0] for row in conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    return set(db.metadata.tables) <= tables and schema_version() >= MIGRATIONS[-1][0]
+
+def run_migrations():
+    version = schema_version()
+    for step, migrate in MIGRATIONS:
+        if step > version:
+            migrate()
+            with db.engine.begin() as conn:
+                conn.exec_driver_sql(f'PRAGMA user_version = {int(step)}')
+            app.logger.info('database migrated to schema version %d', step)
+
 # Init DB + seed services if missing
 def init_db():
-    db.create_all()
+    if not schema_is_current():
+        db.create_all()
+        run_migrations()
+    prune_change_log()
+    # backfill the rollup for databases that predate it
+    if DailySalesRollup.query.first() is None and Sale.query.first() is not None:
+        rebuild_sales_rollup()
     if Service.query.count() == 0:
         db.session.add_all([
             Service(name='Exterior Wash', price=150.0),
@@ -87,11 +710,305 @@ def init_db():
         ])
         db.session.commit()
 
+# --- Hot / archive split ---
+# `flask --app app archive-sales --months N` moves sales (with their items) and
+# payments older than N months into ARCHIVE_PATH and compacts the live database.
+# Checkout, sync and the dashboard only ever use the live file (the daily rollup
+# keeps all history). Exports and range analytics ATTACH the archive when the
+# requested range starts before the archive cutoff and run the same queries
+# against it through a schema translation.
+ARCHIVED_TABLES = (Sale, SaleItem, Payment)
+_ARCHIVED_TABLE_SET = {m.__table__ for m in ARCHIVED_TABLES}
+ARCHIVE_SCHEMA = {'schema_translate_map': {None: 'archive'}}
+archive_metadata = db.MetaData()
+for _model in ARCHIVED_TABLES:
+    _t = _model.__table__
+    _at = db.Table(_t.name, archive_metadata, *[db.Column(c.name, c.type, primary_key=c.primary_key) for c in _t.columns])
+    for _ix in _t.indexes:
+        db.Index(_ix.name, *[_at.c[c.name] for c in _ix.columns], unique=_ix.unique)
+_archive_cutoff = None  # (cutoff datetime or None, monotonic time checked)
+
+def archive_cutoff():
+    """Sales dated before this may live in the archive; None when nothing was archived."""
+    global _archive_cutoff
+    now = time.monotonic()
+    if _archive_cutoff is None or now - _archive_cutoff[1] >= TABLE_VERSION_TTL:
+        value = db.session.query(Setting.value).filter(Setting.key == 'archive_cutoff').scalar()
+        _archive_cutoff = (datetime.fromisoformat(value) if value and os.path.exists(ARCHIVE_PATH) else None, now)
+    return _archive_cutoff[0]
+
+def attach_archive(conn=None):
+    """ATTACH the archive as `archive` on `conn`, default the session's (once per pooled connection)."""
+    if not os.path.exists(ARCHIVE_PATH):
+        return False
+    conn = conn if conn is not None else db.session.connection()
+    if conn.info.get('archive_attached') != ARCHIVE_PATH:
+        conn.exec_driver_sql('ATTACH DATABASE ? AS archive', (ARCHIVE_PATH,))
+        conn.info['archive_attached'] = ARCHIVE_PATH
+    return True
+
+def sale_sources(start=None):
+    """Execution options for each database holding sales dated from `start` on: archive first, then live."""
+    cutoff = archive_cutoff()
+    if cutoff is None or (start is not None and start >= cutoff) or not attach_archive():
+        return [{}]
+    return [ARCHIVE_SCHEMA, {}]
+
+def archived_sale_refs(refs):
+    """{client_ref: sale id} for the refs whose sale has been moved to the archive.
+
+    Reads on a connection of its own: SQLite refuses ATTACH inside the write
+    transaction callers are usually in.
+    """
+    found = {}
+    if not refs or archive_cutoff() is None:
+        return found
+    with db.engine.connect() as conn:
+        if not attach_archive(conn):
+            return found
+        conn = conn.execution_options(**ARCHIVE_SCHEMA)
+        for chunk in _in_chunks(refs):
+            found.update((ref, sale_id) for sale_id, ref in conn.execute(db.select(Sale.id, Sale.client_ref).where(Sale.client_ref.in_(chunk))))
+    return found
+
+def archive_sales(before, vacuum=True):
+    """Move sales, their items and payments dated before `before` to the archive file.
+
+    Returns {table: rows moved}. Rows are copied with INSERT OR REPLACE and only
+    then deleted from the live file, in two transactions, so an interrupted run
+    is finished by running it again. The newest row of each table always stays
+    live so SQLite never hands out an archived id again.
+    """
+    engine = create_engine('sqlite:///' + ARCHIVE_PATH)
+    archive_metadata.create_all(engine)
+    engine.dispose()
+    db.session.remove()
+    cutoff = before.strftime('%Y-%m-%d %H:%M:%S')  # same text form SQLAlchemy stores DateTime in
+    sale, item, payment = (m.__table__.name for m in ARCHIVED_TABLES)
+    moving_sales = f'SELECT id FROM main.{sale} WHERE timestamp < ? AND id < (SELECT max(id) FROM main.{sale})'
+    copies = {
+        sale: (f'id IN ({moving_sales})', (cutoff,)),
+        item: (f'sale_id IN ({moving_sales})', (cutoff,)),
+        payment: (f'timestamp < ? AND id < (SELECT max(id) FROM main.{payment})', (cutoff,)),
+    }
+    moved = {}
+    raw = db.engine.raw_connection()
+    try:
+        cur = raw.cursor()
+        if raw.info.get('archive_attached') != ARCHIVE_PATH:
+            cur.execute('ATTACH DATABASE ? AS archive', (ARCHIVE_PATH,))
+            raw.info['archive_attached'] = ARCHIVE_PATH
+        for model in ARCHIVED_TABLES:
+            name = model.__table__.name
+            cols = ', '.join(f'"{c.name}"' for c in model.__table__.columns)
+            where, params = copies[name]
+            cur.execute(f'INSERT OR REPLACE INTO archive.{name} ({cols}) SELECT {cols} FROM main.{name} WHERE {where}', params)
+        raw.commit()
+        for model in reversed(ARCHIVED_TABLES):  # items before their sales
+            name = model.__table__.name
+            cur.execute(f'DELETE FROM main.{name} WHERE id IN (SELECT id FROM archive.{name})')
+            moved[name] = cur.rowcount
+        previous = cur.execute("SELECT value FROM main.app_setting WHERE key = 'archive_cutoff'").fetchone()
+        if previous is None or previous[0] < before.isoformat():
+            cur.execute("INSERT OR REPLACE INTO main.app_setting (key, value) VALUES ('archive_cutoff', ?)", (before.isoformat(),))
+        raw.commit()
+        if vacuum:
+            cur.execute('VACUUM')
+            cur.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        cur.close()
+    finally:
+        raw.close()
+    global _archive_cutoff
+    _archive_cutoff = None
+    return moved
+
+@app.cli.command('archive-sales')
+@click.option('--months', type=int, default=12, show_default=True, help='Archive sales older than this many months.')
+@click.option('--no-vacuum', is_flag=True, help='Skip compacting the live database afterwards.')
+def archive_sales_command(months, no_vacuum):
+    """Move old sales, sale items and payments into the archive database."""
+    if months < 1:
+        raise click.BadParameter('must be at least 1', param_hint='--months')
+    init_db()  # make sure the app_setting table exists
+    today = datetime.utcnow().date()
+    month = today.year * 12 + today.month - 1 - months
+    before = datetime(month // 12, month % 12 + 1, 1)  # start of the month, so whole months move
+    before_size = os.path.getsize(DB_PATH)
+    moved = archive_sales(before, vacuum=not no_vacuum)
+    print(f'archived before {before.date()}: ' + ', '.join(f'{n} {t}' for t, n in moved.items()))
+    print(f'{DB_PATH}: {before_size // 1024} KiB -> {os.path.getsize(DB_PATH) // 1024} KiB')
+
+# --- Live events (Server-Sent Events) ---
+# Write paths publish compact events to an in-process hub; /api/events streams
+# them to the dashboard and POS terminals. Each open stream holds a server
+# thread, so streams per process are capped. Changes committed by other worker
+# processes (or by bulk writes that publish nothing) are picked up from the
+# change log every EVENTS_POLL seconds and announced as a 'changed' event.
+EVENTS_BUFFER = int(os.getenv('CARWASH_EVENTS_BUFFER', 100))          # queued events per client before it must resync
+EVENTS_MAX_CLIENTS = int(os.getenv('CARWASH_EVENTS_MAX_CLIENTS', 16))  # open streams per process (run.py adds threads for them)
+EVENTS_HEARTBEAT = float(os.getenv('CARWASH_EVENTS_HEARTBEAT', 15))
+EVENTS_POLL = float(os.getenv('CARWASH_EVENTS_POLL', 5))
+EVENTS_MAX_AGE = float(os.getenv('CARWASH_EVENTS_MAX_AGE', 300))      # streams end after this; the browser reconnects
+EVENTS_RETRY_MS = 3000
+EVENT_TABLES = ('sales', 'services', 'appointments')
+EVENTS_RELAY_ROWS = 5000
+
+class EventHub:
+    """In-process publish/subscribe with a bounded queue per subscriber.
+
+    Publishing never blocks: a subscriber whose queue is full has its backlog
+    dropped and gets a single 'resync' event instead. The last EVENTS_BUFFER
+    events are kept so a client reconnecting with Last-Event-ID gets what it
+    missed.
+    """
+    def __init__(self, buffer=EVENTS_BUFFER, max_clients=EVENTS_MAX_CLIENTS):
+        self.buffer = buffer
+        self.max_clients = max_clients
+        self._reset()
+
+    def _reset(self):
+        """Fresh state; also run in forked worker processes, which must not share event ids."""
+        self.epoch = f'{os.getpid():x}.{int(time.time()):x}'  # event ids only mean something to this process
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._recent = collections.deque(maxlen=self.buffer)  # (seq, kind, data json)
+        self._subscribers = set()
+        self._published = collections.deque(maxlen=EVENTS_RELAY_ROWS)  # (table, row id) announced here
+        self._relay_lock = threading.Lock()
+        self._relay_after = 0.0
+        self._last_change = None
+
+    def publish(self, kind, data, rows=()):
+        """Send an event to every subscriber; rows are the (table, id) pairs it announces."""
+        with self._lock:
+            self._seq += 1
+            ev = (self._seq, kind, json_bytes(data).decode())
+            self._recent.append(ev)
+            self._published.extend(rows)
+            for q in self._subscribers:
+                self._offer(q, ev)
+
+    @staticmethod
+    def _offer(q, ev):
+        try:
+            q.put_nowait(ev)
+        except queue.Full:  # slow client: drop its backlog rather than buffer without bound
+            while True:
+                try:
+                    q.get_nowait()
+                except queue.Empty:
+                    break
+            q.put_nowait((ev[0], 'resync', '{}'))
+
+    def subscribe(self, last_event_id=None):
+        """New subscriber queue, primed with missed events; None when the process is at max_clients."""
+        q = queue.Queue(self.buffer)
+        with self._lock:
+            if len(self._subscribers) >= self.max_clients:
+                return None
+            if last_event_id:
+                epoch, _, seq = last_event_id.rpartition('-')
+                oldest = self._recent[0][0] if self._recent else self._seq + 1
+                if epoch == self.epoch and seq.isdigit() and oldest <= int(seq) + 1 <= self._seq + 1:
+                    for ev in self._recent:
+                        if ev[0] > int(seq):
+                            q.put_nowait(ev)
+                else:  # restarted, another worker's id, or too far behind
+                    q.put_nowait((self._seq, 'resync', '{}'))
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def relay(self):
+        """Announce change-log rows this process did not publish (other workers, bulk imports).
+
+        Called from open streams; runs at most once per EVENTS_POLL seconds per
+        process. Needs an app context.
+        """
+        now = time.monotonic()
+        if now < self._relay_after or not self._relay_lock.acquire(blocking=False):
+            return
+        try:
+            self._relay_after = now + EVENTS_POLL
+            q = db.session.query(ChangeLog.id, ChangeLog.table, ChangeLog.row_id).filter(ChangeLog.table.in_(EVENT_TABLES))
+            if self._last_change is None:
+                self._last_change = q.with_entities(db.func.max(ChangeLog.id)).scalar() or 0
+                return
+            rows = q.filter(ChangeLog.id > self._last_change).order_by(ChangeLog.id).limit(EVENTS_RELAY_ROWS).all()
+            if not rows:
+                return
+            self._last_change = rows[-1][0]
+            with self._lock:
+                published = set(self._published)
+            tables = sorted({table for _, table, row_id in rows if (table, row_id) not in published})
+            if tables:
+                invalidate_tables(tables)  # refresh this process's caches now instead of after the TTL
+                self.publish('changed', {'tables': tables})
+        finally:
+            self._relay_lock.release()
+
+events = EventHub()
+if hasattr(os, 'register_at_fork'):  # gunicorn preloads the app in the master and forks workers
+    os.register_at_fork(after_in_child=events._reset)
+
+def event_stream(sub):
+    """SSE frames for one subscriber: events, heartbeats, and a change-log relay check while idle."""
+    deadline = time.monotonic() + EVENTS_MAX_AGE
+    last_sent = next_relay = time.monotonic()
+    try:
+        yield f'retry: {EVENTS_RETRY_MS}\n\n'
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if now >= next_relay:
+                with app.app_context():
+                    events.relay()
+                next_relay = now + EVENTS_POLL
+            if now - last_sent >= EVENTS_HEARTBEAT:
+                last_sent = now
+                yield ': ping\n\n'  # keeps proxies from timing out and notices dead clients
+            try:
+                seq, kind, data = sub.get(timeout=max(0.05, min(next_relay, last_sent + EVENTS_HEARTBEAT, deadline) - now))
+            except queue.Empty:
+                continue
+            last_sent = time.monotonic()
+            yield f'id: {events.epoch}-{seq}\nevent: {kind}\ndata: {data}\n\n'
+    finally:
+        events.unsubscribe(sub)
+
+@app.route('/api/events')
+def api_events():
+    """Server-Sent Events: sale, payment, service, appointment, sale_batch, changed and resync.
+
+    'resync' means events were missed (slow client, restart, other worker):
+    reload state, e.g. with a delta /api/sync.
+    """
+    sub = events.subscribe(request.headers.get('Last-Event-ID') or request.args.get('last_event_id'))
+    if sub is None:
+        resp = jsonify({'error':'too many event streams on this server; poll /api/sync instead'})
+        resp.headers['Retry-After'] = str(int(EVENTS_MAX_AGE))
+        return resp, 503
+    events.relay()  # the first call only records where the change log is
+    resp = Response(event_stream(sub), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'  # nginx: do not buffer the stream
+    resp.call_on_close(lambda: events.unsubscribe(sub))  # also when the stream is never iterated
+    return resp
+
 # --- Test route to verify server is running ---
 @app.route('/test')
 def test():
     return jsonify({'status': 'ok', 'message': 'Server is running!'})
 
+# --- Prometheus metrics (per worker process) ---
+@app.route('/metrics')
+def metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
 # --- Static pages (serve frontend) ---
 @app.route('/')
 def index():
@@ -117,15 +1034,19 @@ def pos_frontend():
 @app.route('/api/services', methods=['GET', 'POST'])
 def api_services():
     if request.method == 'GET':
-        services = Service.query.all()
-        return jsonify([{'id':s.id, 'name':s.name, 'price': s.price} for s in services])
+        return conditional_json('services', lambda: service_catalog()[1])
     data = request.get_json(force=True)
     if not data or 'name' not in data or 'price' not in data:
         return jsonify({'error':'name and price required'}), 400
-    s = Service(name=data['name'], price=float(data['price']))
+    s = Service(name=data['name'], price=float(data['price']), duration_min=int(data.get('duration_min') or 30))
     db.session.add(s); db.session.commit()
+    publish_service(s)
     return jsonify({'id': s.id}), 201
 
+def publish_service(s, deleted=False):
+    data = {'id': s.id, 'deleted': True} if deleted else {'id': s.id, 'name': s.name, 'price': s.price, 'duration_min': s.duration_min}
+    events.publish('service', data, [('services', s.id)])
+
 @app.route('/api/services/<int:sid>', methods=['PUT','DELETE'])
 def api_service_modify(sid):
     s = Service.query.get_or_404(sid)
@@ -133,17 +1054,81 @@ def api_service_modify(sid):
         data = request.get_json(force=True)
         s.name = data.get('name', s.name)
         s.price = float(data.get('price', s.price))
+        s.duration_min = int(data.get('duration_min', s.duration_min))
         db.session.commit()
+        publish_service(s)
         return jsonify({'id': s.id})
     db.session.delete(s); db.session.commit()
+    publish_service(s, deleted=True)
     return jsonify({'deleted': True})
 
+def page_args(default_limit=None, max_limit=1000):
+    """Read ?limit=&offset= into (limit, offset); limit is None when not paginating."""
+    limit = request.args.get('limit', default_limit)
+    offset = int(request.args.get('offset', 0))
+    if limit is None:
+        return None, offset
+    return min(max(int(limit), 1), max_limit), max(offset, 0)
+
+def paginate(q, limit, offset):
+    if limit is not None:
+        q = q.limit(limit)
+    return q.offset(offset) if offset else q
+
+STREAM_BATCH_ROWS = 2000
+
+def wants_ndjson():
+    return request.args.get('format') == 'ndjson' or \
+        request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson']) == 'application/x-ndjson'
+
+def stream_rows(q, id_col, keys):
+    """Stream a column-only query as a JSON array (or NDJSON, see wants_ndjson) in id-keyset batches.
+
+    Nothing is built up in memory: each batch of rows is encoded and sent before
+    the next one is read.
+    """
+    ndjson = wants_ndjson()
+
+    def generate():
+        last_id, first = None, True
+        if not ndjson:
+            yield b'['
+        while True:
+            batch = (q if last_id is None else q.filter(id_col > last_id)).order_by(id_col).limit(STREAM_BATCH_ROWS).all()
+            if batch:
+                objs = [dict(zip(keys, row)) for row in batch]
+                if ndjson:
+                    yield b'\n'.join(json_bytes(o) for o in objs) + b'\n'
+                else:
+                    yield (b'' if first else b',') + json_bytes(objs)[1:-1]
+                first = False
+            if len(batch) < STREAM_BATCH_ROWS:
+                break
+            last_id = batch[-1][0]
+        if not ndjson:
+            yield b']\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson' if ndjson else 'application/json')
+
+def list_rows(q, id_col, keys, limit, offset):
+    """GET list body: streamed when unpaginated, otherwise one page of dicts."""
+    if limit is None and not offset:
+        return stream_rows(q, id_col, keys)
+    rows = [dict(zip(keys, row)) for row in paginate(q.order_by(id_col), limit, offset)]
+    if wants_ndjson():
+        return Response(b''.join(json_bytes(r) + b'\n' for r in rows), mimetype='application/x-ndjson')
+    return rows
+
 # Customers
 @app.route('/api/customers', methods=['GET','POST'])
 def api_customers():
     if request.method == 'GET':
-        cs = Customer.query.all()
-        return jsonify([{'id':c.id,'name':c.name,'phone':c.phone,'email':c.email} for c in cs])
+        try:
+            limit, offset = page_args()
+        except ValueError:
+            return jsonify({'error':'limit and offset must be integers'}), 400
+        return conditional_json('customers', lambda: list_rows(db.session.query(Customer.id, Customer.name, Customer.phone, Customer.email),
+                                                               Customer.id, ('id', 'name', 'phone', 'email'), limit, offset))
     data = request.get_json(force=True)
     if not data or 'name' not in data:
         return jsonify({'error':'name required'}), 400
@@ -155,8 +1140,12 @@ def api_customers():
 @app.route('/api/vehicles', methods=['GET','POST'])
 def api_vehicles():
     if request.method == 'GET':
-        vs = Vehicle.query.all()
-        return jsonify([{'id':v.id,'reg_no':v.reg_no,'model':v.model,'customer_id':v.customer_id} for v in vs])
+        try:
+            limit, offset = page_args()
+        except ValueError:
+            return jsonify({'error':'limit and offset must be integers'}), 400
+        return conditional_json('vehicles', lambda: list_rows(db.session.query(Vehicle.id, Vehicle.reg_no, Vehicle.model, Vehicle.customer_id),
+                                                              Vehicle.id, ('id', 'reg_no', 'model', 'customer_id'), limit, offset))
     data = request.get_json(force=True)
     if not data or 'reg_no' not in data:
         return jsonify({'error':'reg_no required'}), 400
@@ -164,6 +1153,98 @@ def api_vehicles():
     db.session.add(v); db.session.commit()
     return jsonify({'id': v.id}), 201
 
+# Typeahead search over customers and vehicles
+SEARCH_MAX_LIMIT = 50
+_search_fts = None  # whether search_index exists; checked once per process
+
+def search_fts_enabled():
+    global _search_fts
+    if _search_fts is None:
+        with db.engine.connect() as conn:
+            _search_fts = conn.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE name = 'search_index'").scalar() is not None
+    return _search_fts
+
+def search_doc_ids(terms, limit, offset):
+    """Ranked search_index rowids (customer ids, or -vehicle id for ownerless vehicles)."""
+    if search_fts_enabled():
+        match = ' '.join('"%s"*' % t.replace('"', '""') for t in terms)
+        # bm25 column weights: name, phone, email, reg_no, model
+        return [rid for (rid,) in db.session.execute(db.text(
+            'SELECT rowid FROM search_index WHERE search_index MATCH :q '
+            'ORDER BY bm25(search_index, 10.0, 8.0, 2.0, 8.0, 1.0) LIMIT :limit OFFSET :offset'),
+            {'q': match, 'limit': limit, 'offset': offset})]
+    # fallback without FTS5: prefix match of the first term
+    like = terms[0] + '%'
+    cust_ids = db.session.query(Customer.id).filter(db.or_(Customer.name.like(like), Customer.phone.like(like)))
+    veh = db.session.query(Vehicle.customer_id, Vehicle.id).filter(Vehicle.reg_no.like(like))
+    ids = [cid for (cid,) in cust_ids.limit(limit + offset)]
+    ids += [cid if cid is not None else -vid for cid, vid in veh.limit(limit + offset)]
+    return list(dict.fromkeys(ids))[offset:offset + limit]
+
+@app.route('/api/search', methods=['GET'])
+def api_search():
+    """Typeahead search: ?q=<text>&limit=10&offset=0 over customer name/phone/email and vehicle reg_no/model.
+
+    Every word of q is matched as a prefix. Returns ranked customers (with their
+    vehicles) and ownerless vehicles.
+    """
+    terms = re.findall(r'\w+', request.args.get('q', ''))
+    if not terms:
+        return jsonify([])
+    try:
+        limit, offset = page_args(default_limit=10, max_limit=SEARCH_MAX_LIMIT)
+    except ValueError:
+        return jsonify({'error':'limit and offset must be integers'}), 400
+    doc_ids = search_doc_ids(terms, limit, offset)
+    cust_ids = [i for i in doc_ids if i > 0]
+    veh_ids = [-i for i in doc_ids if i < 0]
+
+    customers = {cid: {'type': 'customer', 'id': cid, 'name': name, 'phone': phone, 'email': email, 'vehicles': []}
+                 for cid, name, phone, email in db.session.query(Customer.id, Customer.name, Customer.phone, Customer.email).filter(Customer.id.in_(cust_ids))}
+    vehicles = {}
+    if doc_ids:
+        q = db.session.query(Vehicle.id, Vehicle.reg_no, Vehicle.model, Vehicle.customer_id) \
+            .filter(db.or_(Vehicle.customer_id.in_(cust_ids), Vehicle.id.in_(veh_ids)))
+        for vid, reg_no, model, cid in q:
+            v = {'id': vid, 'reg_no': reg_no, 'model': model, 'customer_id': cid}
+            if cid in customers:
+                customers[cid]['vehicles'].append(v)
+            else:
+                vehicles[vid] = dict(type='vehicle', **v)
+    out = [customers.get(i) if i > 0 else vehicles.get(-i) for i in doc_ids]
+    return jsonify([r for r in out if r is not None])
+
+# Sales (POS) - helpers shared by the sale endpoints
+def load_service_prices(service_ids):
+    """Return {service_id: price} for the given ids from the catalog cache.
+
+    Ids the cache doesn't know (e.g. just created by another worker) are looked
+    up with a single IN (...) query.
+    """
+    ids = {int(sid) for sid in service_ids}
+    cached = service_catalog()[2]
+    prices = {sid: cached[sid] for sid in ids if sid in cached}
+    missing = ids - prices.keys()
+    if missing:
+        prices.update(db.session.query(Service.id, Service.price).filter(Service.id.in_(missing)).all())
+    return prices
+
+def parse_sale_items(items):
+    """Normalise cart lines to [(service_id, qty), ...]; raises ValueError on bad input."""
+    out = []
+    for it in items:
+        if not isinstance(it, dict) or it.get('service_id') is None:
+            raise ValueError('each item needs a service_id')
+        try:
+            sid = int(it['service_id'])
+            qty = int(it.get('qty', 1))
+        except (TypeError, ValueError):
+            raise ValueError(f'invalid item {it!r}')
+        if qty <= 0:
+            raise ValueError(f'invalid qty for service id {sid}')
+        out.append((sid, qty))
+    return out
+
 # Sales (POS) - create sale and optionally create appointment
 @app.route('/api/sale', methods=['POST'])
 def api_sale():
@@ -176,49 +1257,71 @@ def api_sale():
       "items": [{"service_id": 1, "qty": 1, "price": 150}],
       "subtotal": 150, "tax": 0, "total": 150, "timestamp": "...", "create_appointment": true
     }
+    Everything is written in one transaction; nothing is saved if any step fails.
+    The appointment records the wash and is never refused: when it overlaps a
+    full bay (or falls outside opening hours) the 201 body carries
+    "appointment_conflict". "timestamp" with a UTC offset is converted to shop time.
     """
     data = request.get_json() or {}
-    # customer
-    cust = None
-    cust_in = data.get('customer') or {}
-    if cust_in.get('id'):
-        cust = Customer.query.get(cust_in.get('id'))
-    if not cust and cust_in.get('name'):
-        # try to find by name+phone
-        cust = Customer.query.filter_by(name=cust_in.get('name'), phone=cust_in.get('phone')).first()
-        if not cust:
-            cust = Customer(name=cust_in.get('name'), phone=cust_in.get('phone'))
-            db.session.add(cust); db.session.commit()
-
-    # vehicle
-    veh = None
-    veh_in = data.get('vehicle') or {}
-    if veh_in.get('reg_no'):
-        veh = Vehicle.query.filter_by(reg_no=veh_in.get('reg_no')).first()
-        if not veh:
-            veh = Vehicle(reg_no=veh_in.get('reg_no'), model=veh_in.get('model'), owner=cust)
-            db.session.add(veh); db.session.commit()
-
-    # optionally create appointment
-    appt = None
-    if data.get('create_appointment'):
-        svc_id = None
-        items = data.get('items') or []
-        if items:
-            svc_id = int(items[0].get('service_id'))
-        if svc_id and veh:
-            appt = Appointment(vehicle_id=veh.id, service_id=svc_id, scheduled_at=datetime.fromisoformat(data.get('timestamp')) if data.get('timestamp') else datetime.utcnow(), status='done' if data.get('create_appointment_done') else 'scheduled', paid=bool(data.get('total')))
-            db.session.add(appt); db.session.commit()
-
-    # record payment
-    if data.get('total'):
-        p = Payment(appointment_id=appt.id if appt else None, amount=float(data.get('total')), method=data.get('method') or 'cash')
-        db.session.add(p)
-        if appt:
-            appt.paid = True
+    try:
+        # customer
+        cust = None
+        cust_in = data.get('customer') or {}
+        if cust_in.get('id'):
+            cust = Customer.query.get(cust_in.get('id'))
+        if not cust and cust_in.get('name'):
+            # try to find by name+phone
+            cust = Customer.query.filter_by(name=cust_in.get('name'), phone=cust_in.get('phone')).first()
+            if not cust:
+                cust = Customer(name=cust_in.get('name'), phone=cust_in.get('phone'))
+                db.session.add(cust)
+
+        # vehicle
+        veh = None
+        veh_in = data.get('vehicle') or {}
+        if veh_in.get('reg_no'):
+            veh = Vehicle.query.filter_by(reg_no=veh_in.get('reg_no')).first()
+            if not veh:
+                veh = Vehicle(reg_no=veh_in.get('reg_no'), model=veh_in.get('model'), owner=cust)
+                db.session.add(veh)
+
+        # optionally create appointment
+        appt = None
+        if data.get('create_appointment'):
+            svc_id = None
+            items = data.get('items') or []
+            if items:
+                svc_id = int(items[0].get('service_id'))
+            if svc_id and veh:
+                appt = Appointment(service_id=svc_id, scheduled_at=parse_appointment_time(data['timestamp']) if data.get('timestamp') else shop_time(), status='done' if data.get('create_appointment_done') else 'scheduled', paid=bool(data.get('total')))
+                appt.vehicle = veh
+                db.session.add(appt)
+
+        # record payment
+        if data.get('total'):
+            p = Payment(amount=float(data.get('total')), method=data.get('method') or 'cash')
+            p.appointment = appt
+            db.session.add(p)
+            if appt:
+                appt.paid = True
+
+        conflict = appt is not None and not sale_appointment_fits(appt)
         db.session.commit()
+    except (TypeError, ValueError) as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    except Exception:
+        db.session.rollback()
+        raise
 
-    return jsonify({'ok': True, 'customer_id': cust.id if cust else None, 'vehicle_id': veh.id if veh else None, 'appointment_id': appt.id if appt else None}), 201
+    if data.get('total'):
+        events.publish('payment', {'id': p.id, 'amount': p.amount, 'method': p.method, 'appointment_id': appt.id if appt else None})
+    if appt is not None:
+        publish_appointment(appt)
+    result = {'ok': True, 'customer_id': cust.id if cust else None, 'vehicle_id': veh.id if veh else None, 'appointment_id': appt.id if appt else None}
+    if conflict:
+        result['appointment_conflict'] = 'no free bay at that time'
+    return jsonify(result), 201
 @app.route('/api/sales', methods=['POST'])
 def api_create_sale():
     """
@@ -230,68 +1333,607 @@ def api_create_sale():
       "method": "cash",
       "create_appointment": true/false,
       "appointment_service_id": <service id> (optional),
-      "scheduled_at": "YYYY-MM-DD HH:MM" (optional)
+      "scheduled_at": "YYYY-MM-DD HH:MM" (optional),
+      "idempotency_key": "s_xxx" (optional; a retry with the same key returns the first sale)
     }
+    The customer, vehicle, sale, items and appointment are saved in a single
+    transaction; service prices are loaded with one query per cart.
     """
     data = request.get_json(force=True)
     if not data or 'items' not in data or not isinstance(data['items'], list) or len(data['items'])==0:
         return jsonify({'error':'items required'}), 400
+    client_ref = str(data['idempotency_key'])[:64] if data.get('idempotency_key') else None
+    if client_ref:
+        existing = db.session.query(Sale.id).filter(Sale.client_ref == client_ref).scalar() \
+            or archived_sale_refs([client_ref]).get(client_ref)
+        if existing:
+            return jsonify({'sale_id': existing, 'duplicate': True}), 200
 
-    # customer
-    cust = None
-    if data.get('customer'):
-        cdata = data['customer']
-        if isinstance(cdata, dict) and cdata.get('id'):
-            cust = Customer.query.get(cdata.get('id'))
-        elif isinstance(cdata, dict) and cdata.get('name'):
-            cust = Customer(name=cdata.get('name'), phone=cdata.get('phone'))
-            db.session.add(cust); db.session.commit()
-
-    # vehicle
-    v = None
-    if data.get('vehicle') and data['vehicle'].get('reg_no'):
-        v = Vehicle.query.filter_by(reg_no=data['vehicle']['reg_no']).first()
-        if not v:
-            v = Vehicle(reg_no=data['vehicle']['reg_no'], model=data['vehicle'].get('model'), customer_id=cust.id if cust else None)
-            db.session.add(v); db.session.commit()
-
-    # create sale
-    sale = Sale(customer_id=cust.id if cust else None, vehicle_id=v.id if v else None, total=0.0, paid=True, method=data.get('method','cash'))
-    db.session.add(sale); db.session.commit()
-
-    total = 0.0
-    for it in data['items']:
-        svc = Service.query.get(int(it['service_id']))
-        if not svc:
-            db.session.rollback()
-            return jsonify({'error':f'service id {it.get("service_id")} not found'}), 400
-        qty = int(it.get('qty',1))
-        line = svc.price * qty
-        si = SaleItem(sale_id=sale.id, service_id=svc.id, qty=qty, price=svc.price, line_total=line)
-        db.session.add(si)
-        total += line
-    sale.total = total
-    db.session.commit()
-
-    result = {'sale_id': sale.id}
+    # validate the cart and price it before touching the session
+    try:
+        lines = parse_sale_items(data['items'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    prices = load_service_prices(sid for sid, _ in lines)
+    for sid, _ in lines:
+        if sid not in prices:
+            return jsonify({'error':f'service id {sid} not found'}), 400
 
+    scheduled_dt = None
     if data.get('create_appointment'):
-        appt_svc = data.get('appointment_service_id') or data['items'][0]['service_id']
+        appt_svc = int(data.get('appointment_service_id') or lines[0][0])
+        if appt_svc not in prices and appt_svc not in load_service_prices([appt_svc]):
+            return jsonify({'error':f'service id {appt_svc} not found'}), 400
         scheduled_at = data.get('scheduled_at')
-        if scheduled_at:
-            scheduled_dt = datetime.strptime(scheduled_at, '%Y-%m-%d %H:%M')
-        else:
-            scheduled_dt = datetime.utcnow()
-        # ensure vehicle exists (appointment needs vehicle)
-        if not v:
-            v = Vehicle(reg_no=f'WALKIN-{sale.id}', model='', customer_id=cust.id if cust else None)
-            db.session.add(v); db.session.commit()
-        appt = Appointment(vehicle_id=v.id, service_id=int(appt_svc), scheduled_at=scheduled_dt, status='done', paid=True)
-        db.session.add(appt); db.session.commit()
-        result['appointment_id'] = appt.id
+        try:
+            scheduled_dt = datetime.strptime(scheduled_at, '%Y-%m-%d %H:%M') if scheduled_at else shop_time()
+        except ValueError:
+            return jsonify({'error':'scheduled_at must be YYYY-MM-DD HH:MM'}), 400
 
+    try:
+        # customer
+        cust = None
+        if data.get('customer'):
+            cdata = data['customer']
+            if isinstance(cdata, dict) and cdata.get('id'):
+                cust = Customer.query.get(cdata.get('id'))
+            elif isinstance(cdata, dict) and cdata.get('name'):
+                cust = Customer(name=cdata.get('name'), phone=cdata.get('phone'))
+                db.session.add(cust)
+
+        # vehicle
+        v = None
+        if data.get('vehicle') and data['vehicle'].get('reg_no'):
+            v = Vehicle.query.filter_by(reg_no=data['vehicle']['reg_no']).first()
+            if not v:
+                v = Vehicle(reg_no=data['vehicle']['reg_no'], model=data['vehicle'].get('model'), owner=cust)
+                db.session.add(v)
+
+        # create sale with its items
+        sale = Sale(paid=True, method=data.get('method','cash'), timestamp=datetime.utcnow(), client_ref=client_ref)
+        sale.customer = cust
+        sale.vehicle = v
+        total = 0.0
+        for sid, qty in lines:
+            price = prices[sid]
+            line = price * qty
+            sale.items.append(SaleItem(service_id=sid, qty=qty, price=price, line_total=line))
+            total += line
+        sale.total = total
+        db.session.add(sale)
+        record_sale_rollup(sale)
+
+        appt = None
+        if scheduled_dt is not None:
+            # ensure vehicle exists (appointment needs vehicle)
+            if not v:
+                db.session.flush()  # assigns sale.id for the walk-in reg_no
+                v = Vehicle(reg_no=f'WALKIN-{sale.id}', model='', owner=cust)
+                db.session.add(v)
+            appt = Appointment(service_id=appt_svc, scheduled_at=scheduled_dt, status='done', paid=True)
+            appt.vehicle = v
+            db.session.add(appt)
+            conflict = not sale_appointment_fits(appt)
+
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        if client_ref:  # same key committed concurrently by a retry
+            return jsonify({'sale_id': db.session.query(Sale.id).filter(Sale.client_ref == client_ref).scalar(), 'duplicate': True}), 200
+        raise
+    except Exception:
+        db.session.rollback()
+        raise
+
+    events.publish('sale', {'id': sale.id, 'total': sale.total, 'method': sale.method, 'timestamp': sale.timestamp.isoformat(),
+                            'customer_id': sale.customer_id, 'vehicle_id': sale.vehicle_id}, [('sales', sale.id)])
+    result = {'sale_id': sale.id}
+    if appt is not None:
+        publish_appointment(appt)
+        result['appointment_id'] = appt.id
+        if conflict:
+            result['appointment_conflict'] = 'no free bay at that time'
     return jsonify(result), 201
 
+# Bulk replay of offline POS sales
+SALES_BATCH_MAX = 1000
+
+def parse_batch_sale(s):
+    """Validate one batch entry; returns (key, normalised dict) or raises ValueError."""
+    if not isinstance(s, dict):
+        raise ValueError('sale must be an object')
+    key = s.get('idempotency_key') or s.get('id')
+    if not key:
+        raise ValueError('idempotency_key (or id) required')
+    if not isinstance(s.get('items'), list) or not s['items']:
+        raise ValueError('items required')
+    lines = parse_sale_items(s['items'])
+    client_prices = {}
+    for it in s['items']:
+        if it.get('price') is not None:
+            client_prices[int(it['service_id'])] = float(it['price'])
+    ts = s.get('timestamp')
+    ts = datetime.fromisoformat(ts.replace('Z', '+00:00')) if ts else datetime.utcnow()
+    if ts.tzinfo is not None:  # stored timestamps are naive UTC
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    cust = s.get('customer') if isinstance(s.get('customer'), dict) else {}
+    veh = s.get('vehicle') if isinstance(s.get('vehicle'), dict) else {}
+    cust_id = cust.get('id')
+    if cust_id is not None and not isinstance(cust_id, int):
+        cust_id = int(cust_id) if str(cust_id).isdigit() else None  # offline ids like c_xxx
+    return str(key)[:64], {
+        'lines': lines, 'client_prices': client_prices, 'timestamp': ts,
+        'method': s.get('method') or 'cash',
+        'customer_id': cust_id, 'customer': (cust.get('name'), cust.get('phone')) if cust.get('name') else None,
+        'reg_no': veh.get('reg_no') or None, 'model': veh.get('model'),
+        'create_appointment': bool(s.get('create_appointment')),
+    }
+
+def _in_chunks(values):
+    values = list(values)
+    for i in range(0, len(values), SQL_IN_CHUNK):
+        yield values[i:i + SQL_IN_CHUNK]
+
+@app.route('/api/sales/batch', methods=['POST'])
+def api_sales_batch():
+    """Idempotently ingest many sales (e.g. offline POS sales) in one transaction.
+
+    Expected JSON: {"sales": [{"idempotency_key": "s_xxx", "customer": {...},
+    "vehicle": {...}, "items": [{"service_id": 1, "qty": 1, "price": 150}],
+    "method": "cash", "timestamp": "...", "create_appointment": false}, ...]}
+    ("id" is accepted as the key, matching the POS offline sale format.)
+    Item prices default to the current catalog price. Customers are matched by
+    id or name+phone and vehicles by reg_no, creating missing ones in bulk.
+    Returns {"results": {key: {"status": "created"|"duplicate"|"error", ...}}}.
+    """
+    data = request.get_json(force=True, silent=True) or {}
+    entries = data.get('sales')
+    if not isinstance(entries, list) or not entries:
+        return jsonify({'error':'sales list required'}), 400
+    if len(entries) > SALES_BATCH_MAX:
+        return jsonify({'error':f'at most {SALES_BATCH_MAX} sales per batch'}), 413
+
+    results, pending = {}, {}
+    for i, s in enumerate(entries):
+        try:
+            key, sale = parse_batch_sale(s)
+        except (TypeError, ValueError, AttributeError) as e:
+            raw = (s.get('idempotency_key') or s.get('id')) if isinstance(s, dict) else None
+            key = str(raw)[:64] if raw else f'#{i}'
+            results[key] = {'status': 'error', 'error': str(e)}
+            continue
+        if key in pending or key in results:
+            results.setdefault(key, {'status': 'duplicate'})
+            continue
+        pending[key] = sale
+
+    try:
+        sale_ids = ingest_sales(pending, results)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'error':'batch conflicted with a concurrent write; retry it'}), 409
+    except Exception:
+        db.session.rollback()
+        raise
+
+    for key, sale_id in sale_ids.items():
+        results[key] = {'status': 'created', 'sale_id': sale_id}
+    if sale_ids:  # one event for the whole replay; clients delta-sync
+        events.publish('sale_batch', {'count': len(sale_ids)}, [('sales', sid) for sid in sale_ids.values()])
+    return jsonify({'results': results})
+
+def ingest_sales(pending, results):
+    """Write parsed sales ({key: parse_batch_sale() dict}) in the current transaction.
+
+    Duplicates and sales naming unknown services are recorded in `results` and
+    skipped; the caller commits. Returns {key: new sale id}.
+    """
+    # already ingested, including sales archived since
+    for chunk in _in_chunks(pending):
+        for sale_id, ref in db.session.query(Sale.id, Sale.client_ref).filter(Sale.client_ref.in_(chunk)):
+            results[ref] = {'status': 'duplicate', 'sale_id': sale_id}
+            del pending[ref]
+    for ref, sale_id in archived_sale_refs(list(pending)).items():
+        results[ref] = {'status': 'duplicate', 'sale_id': sale_id}
+        del pending[ref]
+
+    # price every line from one catalog query
+    prices = load_service_prices(sid for s in pending.values() for sid, _ in s['lines'])
+    for key, s in list(pending.items()):
+        missing = [sid for sid, _ in s['lines'] if sid not in prices]
+        if missing:
+            results[key] = {'status': 'error', 'error': f'service id {missing[0]} not found'}
+            del pending[key]
+    if not pending:
+        return {}
+
+    # customers: by id, else find-or-create by name+phone
+    known_ids = {s['customer_id'] for s in pending.values() if s['customer_id'] is not None}
+    existing_ids = set()
+    for chunk in _in_chunks(known_ids):
+        existing_ids.update(cid for (cid,) in db.session.query(Customer.id).filter(Customer.id.in_(chunk)))
+    wanted = {s['customer'] for s in pending.values() if s['customer'] and s['customer_id'] not in existing_ids}
+    by_pair = {}
+    def load_customers(names):
+        for chunk in _in_chunks(names):
+            for cid, name, phone in db.session.query(Customer.id, Customer.name, Customer.phone).filter(Customer.name.in_(chunk)).order_by(Customer.id):
+                by_pair.setdefault((name, phone), cid)
+    load_customers({name for name, _ in wanted})
+    new_customers = [pair for pair in wanted if pair not in by_pair]
+    if new_customers:
+        db.session.execute(Customer.__table__.insert(), [{'name': n, 'phone': p} for n, p in new_customers])
+        load_customers({name for name, _ in new_customers})
+        log_changes('customers', [by_pair[pair] for pair in new_customers])
+    for s in pending.values():
+        if s['customer_id'] not in existing_ids:
+            s['customer_id'] = by_pair.get(s['customer'])
+
+    # vehicles: find-or-create by reg_no (also walk-in vehicles for appointments)
+    reg_nos = {s['reg_no'] for s in pending.values() if s['reg_no']}
+    by_reg = {}
+    def load_vehicles(regs):
+        for chunk in _in_chunks(regs):
+            by_reg.update(db.session.query(Vehicle.reg_no, Vehicle.id).filter(Vehicle.reg_no.in_(chunk)))
+    load_vehicles(reg_nos)
+    new_vehicles = {}
+    for s in pending.values():
+        if s['reg_no'] and s['reg_no'] not in by_reg:
+            new_vehicles.setdefault(s['reg_no'], {'reg_no': s['reg_no'], 'model': s['model'], 'customer_id': s['customer_id']})
+    if new_vehicles:
+        db.session.execute(sqlite_insert(Vehicle.__table__).on_conflict_do_nothing(index_elements=['reg_no']), list(new_vehicles.values()))
+        load_vehicles(new_vehicles)
+        log_changes('vehicles', [by_reg[r] for r in new_vehicles])
+
+    # sales, then items keyed by the new sale ids
+    sale_rows = []
+    for key, s in pending.items():
+        s['items'] = [(sid, qty, s['client_prices'].get(sid, prices[sid])) for sid, qty in s['lines']]
+        s['total'] = sum(qty * price for _, qty, price in s['items'])
+        sale_rows.append({'customer_id': s['customer_id'], 'vehicle_id': by_reg.get(s['reg_no']), 'total': s['total'],
+                          'paid': True, 'method': s['method'], 'timestamp': s['timestamp'], 'client_ref': key})
+    db.session.execute(Sale.__table__.insert(), sale_rows)
+    sale_ids = {}
+    for chunk in _in_chunks(pending):
+        sale_ids.update((ref, sid) for sid, ref in db.session.query(Sale.id, Sale.client_ref).filter(Sale.client_ref.in_(chunk)))
+    db.session.execute(SaleItem.__table__.insert(), [
+        {'sale_id': sale_ids[key], 'service_id': sid, 'qty': qty, 'price': price, 'line_total': qty * price}
+        for key, s in pending.items() for sid, qty, price in s['items']])
+    log_changes('sales', sale_ids.values())
+    apply_rollup([row for s in pending.values()
+                  for row in sale_rollup_rows(s['timestamp'], s['method'], s['total'], [(sid, qty, qty * price) for sid, qty, price in s['items']])])
+
+    # appointments (done + paid, like POST /api/sales); walk-ins get a WALKIN-<sale id> vehicle
+    appt_sales = [(key, s) for key, s in pending.items() if s['create_appointment']]
+    walkins = {f'WALKIN-{sale_ids[key]}': s['customer_id'] for key, s in appt_sales if not s['reg_no']}
+    if walkins:
+        db.session.execute(Vehicle.__table__.insert(), [{'reg_no': r, 'model': '', 'customer_id': c} for r, c in walkins.items()])
+        load_vehicles(walkins)
+        log_changes('vehicles', [by_reg[r] for r in walkins])
+    if appt_sales:
+        # These record washes that already happened (offline sales, imports), so they
+        # are not capacity-checked like live bookings; they are stored in shop time
+        # so they still occupy their bay in the slot index.
+        # this transaction already holds SQLite's write lock, so the new ids follow the current max
+        first_id = (db.session.query(db.func.max(Appointment.id)).scalar() or 0) + 1
+        db.session.execute(Appointment.__table__.insert(), [
+            {'id': first_id + i, 'vehicle_id': by_reg[s['reg_no'] or f'WALKIN-{sale_ids[key]}'], 'service_id': s['lines'][0][0],
+             'scheduled_at': shop_time(s['timestamp']), 'status': 'done', 'paid': True}
+            for i, (key, s) in enumerate(appt_sales)])
+        log_changes('appointments', range(first_id, first_id + len(appt_sales)))
+
+    return sale_ids
+
+# --- Bulk import (CSV / JSON Lines) ---
+# Onboarding loads from an old POS: rows are read as a stream, validated, and
+# written IMPORT_CHUNK_ROWS at a time with executemany, one transaction per chunk.
+# Customer<->vehicle links are resolved by phone and reg_no through in-memory maps
+# loaded once per import. Historical sales go through the same path as
+# /api/sales/batch and are idempotent on their `ref`.
+IMPORT_KINDS = ('customers', 'vehicles', 'services', 'sales')
+IMPORT_FORMATS = ('csv', 'jsonl')
+IMPORT_CHUNK_ROWS = int(os.getenv('CARWASH_IMPORT_CHUNK', 5000))
+IMPORT_MAX_ERRORS = 100  # rejected rows listed in the summary (all are counted)
+
+def _clean(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+def iter_import_records(binary, fmt):
+    """Yield (line number, record dict) from a binary CSV or JSON Lines stream; bad JSON yields the error."""
+    if not hasattr(binary, 'read1'):
+        binary = io.BufferedReader(binary)
+    text = io.TextIOWrapper(binary, encoding='utf-8-sig', newline='' if fmt == 'csv' else None)
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        for rec in reader:
+            yield reader.line_num, {k.strip().lower(): v for k, v in rec.items() if k}
+        return
+    for line_no, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            rec = json.loads(line)
+        except ValueError as e:
+            yield line_no, ValueError(f'invalid JSON: {e}')
+            continue
+        yield line_no, rec if isinstance(rec, dict) else ValueError('each line must be a JSON object')
+
+def group_sale_rows(records):
+    """Fold consecutive flat CSV rows sharing a `ref` into one sale with an `items` list."""
+    current = None
+    for line, rec in records:
+        if isinstance(rec, Exception) or 'items' in rec:
+            if current:
+                yield current
+                current = None
+            yield line, rec
+            continue
+        item = {'service_id': rec.get('service_id'), 'service': rec.get('service'), 'qty': rec.get('qty'), 'price': rec.get('price')}
+        ref = _clean(rec.get('ref'))
+        if current and ref and _clean(current[1].get('ref')) == ref:
+            current[1]['items'].append(item)
+            continue
+        if current:
+            yield current
+        current = (line, dict(rec, items=[item]))
+    if current:
+        yield current
+
+class BulkImporter:
+    """Import one kind of record; run() returns a summary with counts and rejected rows.
+
+    `vehicles` counts vehicles created alongside customers (reg_no column in a customer file).
+    """
+    def __init__(self, kind, chunk_rows=IMPORT_CHUNK_ROWS):
+        if kind not in IMPORT_KINDS:
+            raise ValueError(f'kind must be one of {", ".join(IMPORT_KINDS)}')
+        self.kind = kind
+        self.chunk_rows = chunk_rows
+        self.summary = {'kind': kind, 'rows': 0, 'inserted': 0, 'updated': 0, 'skipped': 0, 'rejected': 0, 'vehicles': 0, 'errors': []}
+        self._phones = None  # phone -> customer id
+        self._regs = None    # reg_no -> vehicle id
+
+    def reject(self, line, error):
+        self.summary['rejected'] += 1
+        if len(self.summary['errors']) < IMPORT_MAX_ERRORS:
+            self.summary['errors'].append({'line': line, 'error': str(error)})
+
+    @property
+    def phones(self):
+        if self._phones is None:
+            self._phones = {}
+            for cid, phone in db.session.query(Customer.id, Customer.phone).filter(Customer.phone.isnot(None)).order_by(Customer.id):
+                self._phones.setdefault(phone, cid)
+        return self._phones
+
+    @property
+    def regs(self):
+        if self._regs is None:
+            self._regs = dict(db.session.query(Vehicle.reg_no, Vehicle.id))
+        return self._regs
+
+    def insert(self, model, rows):
+        """executemany-insert rows and return their new ids, in order."""
+        if not rows:
+            return []
+        db.session.execute(model.__table__.insert(), rows)
+        last = db.session.query(db.func.max(model.id)).scalar()  # flush() holds the write lock: ours are the newest ids
+        return list(range(last - len(rows) + 1, last + 1))
+
+    def run(self, records):
+        started = time.perf_counter()
+        if self.kind == 'sales':
+            records = group_sale_rows(records)
+        chunk = []
+        for line, rec in records:
+            self.summary['rows'] += 1
+            if isinstance(rec, Exception):
+                self.reject(line, rec)
+                continue
+            chunk.append((line, rec))
+            if len(chunk) >= self.chunk_rows:
+                self.flush(chunk)
+                chunk = []
+        if chunk:
+            self.flush(chunk)
+        self.summary['seconds'] = round(time.perf_counter() - started, 3)
+        return self.summary
+
+    def flush(self, chunk):
+        counts = {k: self.summary[k] for k in ('inserted', 'updated', 'skipped', 'rejected', 'vehicles')}
+        errors = len(self.summary['errors'])
+        try:
+            # take the write lock up front: new ids are then known, and the trigger swap is transactional
+            db.session.connection().exec_driver_sql('BEGIN IMMEDIATE')
+            with bulk_search_index():
+                getattr(self, 'import_' + self.kind)(chunk)
+            db.session.commit()
+        except IntegrityError as e:
+            db.session.rollback()
+            self.summary.update(counts)
+            del self.summary['errors'][errors:]
+            self._phones = self._regs = None  # may hold ids from the rolled back chunk
+            for line, _ in chunk:
+                self.reject(line, f'chunk rolled back: {e.orig}')
+        except Exception:
+            db.session.rollback()
+            raise
+
+    def import_customers(self, chunk):
+        """name (required), phone, email; optional reg_no/model add the customer's vehicle."""
+        new, vehicles = [], []
+        for line, rec in chunk:
+            name, phone = _clean(rec.get('name')), _clean(rec.get('phone'))
+            if not name:
+                self.reject(line, 'name required')
+                continue
+            reg_no = _clean(rec.get('reg_no'))
+            if phone and phone in self.phones:
+                self.summary['skipped'] += 1
+                continue
+            if phone:
+                self.phones[phone] = None  # claimed by this file; id filled in below
+            new.append({'name': name, 'phone': phone, 'email': _clean(rec.get('email'))})
+            vehicles.append((line, reg_no, _clean(rec.get('model'))))
+        ids = self.insert(Customer, new)
+        self.summary['inserted'] += len(ids)
+        log_changes('customers', ids)
+        for row, cid in zip(new, ids):
+            if row['phone']:
+                self.phones[row['phone']] = cid
+        self.insert_vehicles([(line, {'reg_no': reg_no, 'model': model, 'customer_id': cid})
+                              for (line, reg_no, model), cid in zip(vehicles, ids) if reg_no])
+
+    def import_vehicles(self, chunk):
+        """reg_no (required), model; owner by customer_phone (or phone) or customer_id."""
+        rows = []
+        for line, rec in chunk:
+            reg_no = _clean(rec.get('reg_no'))
+            if not reg_no:
+                self.reject(line, 'reg_no required')
+                continue
+            phone = _clean(rec.get('customer_phone') or rec.get('phone'))
+            cid = _clean(rec.get('customer_id'))
+            if phone:
+                cid = self.phones.get(phone)
+                if cid is None:
+                    self.reject(line, f'no customer with phone {phone}')
+                    continue
+            elif cid is not None:
+                if not cid.isdigit():
+                    self.reject(line, 'customer_id must be a number')
+                    continue
+                cid = int(cid)
+            rows.append((line, {'reg_no': reg_no, 'model': _clean(rec.get('model')), 'customer_id': cid}))
+        self.insert_vehicles(rows)
+
+    def insert_vehicles(self, rows):
+        new = []
+        for line, row in rows:
+            if row['reg_no'] in self.regs:
+                self.summary['skipped'] += 1
+                continue
+            self.regs[row['reg_no']] = None
+            new.append(row)
+        ids = self.insert(Vehicle, new)
+        self.summary['inserted' if self.kind == 'vehicles' else 'vehicles'] += len(ids)
+        log_changes('vehicles', ids)
+        self.regs.update((row['reg_no'], vid) for row, vid in zip(new, ids))
+
+    def import_services(self, chunk):
+        """name and price (required), duration_min; existing services (same name) are updated."""
+        by_name = {s.name: s for s in Service.query.all()}  # the catalog is small
+        for line, rec in chunk:
+            name = _clean(rec.get('name'))
+            try:
+                price = float(rec.get('price'))
+                duration = int(rec['duration_min']) if _clean(rec.get('duration_min')) else None
+            except (TypeError, ValueError, KeyError):
+                self.reject(line, 'numeric price required (duration_min in whole minutes)')
+                continue
+            if not name:
+                self.reject(line, 'name required')
+                continue
+            svc = by_name.get(name)
+            if svc is None:
+                svc = by_name[name] = Service(name=name, price=price, duration_min=duration or 30)
+                db.session.add(svc)
+                self.summary['inserted'] += 1
+            else:
+                svc.price = price
+                if duration:
+                    svc.duration_min = duration
+                self.summary['updated'] += 1
+
+    def import_sales(self, chunk):
+        """Historical sales in /api/sales/batch form or flat rows (ref, timestamp, method,
+        customer_name, customer_phone, reg_no, model, service_id or service, qty, price)."""
+        service_ids = {s['name'].lower(): s['id'] for s in service_catalog()[1]}
+        lines, pending, results = {}, {}, {}
+        for line, rec in chunk:
+            try:
+                key, sale = parse_batch_sale(self.sale_entry(rec, service_ids))
+            except (TypeError, ValueError, AttributeError, KeyError) as e:
+                self.reject(line, e)
+                continue
+            if key in pending:
+                self.summary['skipped'] += 1
+                continue
+            lines[key] = line
+            pending[key] = sale
+        sale_ids = ingest_sales(pending, results)
+        self.summary['inserted'] += len(sale_ids)
+        for key, res in results.items():
+            if res['status'] == 'duplicate':
+                self.summary['skipped'] += 1
+            else:
+                self.reject(lines[key], res.get('error'))
+
+    def sale_entry(self, rec, service_ids):
+        """Map one import record onto the /api/sales/batch entry format."""
+        items = []
+        for it in rec.get('items') or []:
+            sid = _clean(it.get('service_id'))
+            if sid is None and _clean(it.get('service')):
+                sid = service_ids.get(_clean(it['service']).lower())
+                if sid is None:
+                    raise ValueError(f'unknown service {it["service"]!r}')
+            price = _clean(it.get('price'))
+            items.append({'service_id': sid, 'qty': _clean(it.get('qty')) or 1, 'price': float(price) if price else None})
+        cust = rec.get('customer') if isinstance(rec.get('customer'), dict) else \
+            {'name': _clean(rec.get('customer_name')), 'phone': _clean(rec.get('customer_phone'))}
+        phone = _clean(cust.get('phone'))
+        if not cust.get('id') and phone and self.phones.get(phone):
+            cust = {'id': self.phones[phone]}
+        veh = rec.get('vehicle') if isinstance(rec.get('vehicle'), dict) else \
+            {'reg_no': _clean(rec.get('reg_no')), 'model': _clean(rec.get('model'))}
+        key = _clean(rec.get('ref') or rec.get('idempotency_key') or rec.get('id'))
+        if key is None:  # content hash, so re-running the same file does not duplicate sales
+            key = 'imp_' + hashlib.sha1(json.dumps(rec, sort_keys=True, default=str).encode()).hexdigest()[:24]
+        return {'idempotency_key': key, 'timestamp': _clean(rec.get('timestamp')), 'method': _clean(rec.get('method')),
+                'customer': cust, 'vehicle': veh, 'items': items}
+
+def import_format(fmt, filename):
+    fmt = (fmt or os.path.splitext(filename or '')[1].lstrip('.')).lower()
+    fmt = {'ndjson': 'jsonl', 'json': 'jsonl'}.get(fmt, fmt)
+    if fmt not in IMPORT_FORMATS:
+        raise ValueError('format must be csv or jsonl')
+    return fmt
+
+@app.route('/api/import/<kind>', methods=['POST'])
+def api_import(kind):
+    """Bulk-load customers, vehicles, services or sales from CSV or JSON Lines.
+
+    Send the file as multipart field `file` or as the raw request body with
+    ?format=csv|jsonl. Returns the import summary (counts plus the first
+    rejected rows with their line numbers).
+    """
+    upload = request.files.get('file')
+    try:
+        fmt = import_format(request.args.get('format'), upload.filename if upload else None)
+        importer = BulkImporter(kind)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    stream = upload.stream if upload else request.stream
+    return jsonify(importer.run(iter_import_records(stream, fmt)))
+
+@app.cli.command('import-data')
+@click.argument('kind', type=click.Choice(IMPORT_KINDS))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(IMPORT_FORMATS), help='Defaults to the file extension.')
+def import_data_command(kind, path, fmt):
+    """Bulk-load a CSV or JSON Lines file of customers, vehicles, services or sales."""
+    init_db()
+    with open(path, 'rb') as f:
+        summary = BulkImporter(kind).run(iter_import_records(f, import_format(fmt, path)))
+    print(f"{summary['rows']} rows in {summary['seconds']}s: {summary['inserted']} inserted, {summary['updated']} updated, "
+          f"{summary['skipped']} skipped, {summary['rejected']} rejected")
+    for err in summary['errors']:
+        print(f"  line {err['line']}: {err['error']}")
+
 # Get sale invoice
 @app.route('/api/sales/<int:sale_id>', methods=['GET'])
 def api_get_sale(sale_id):
@@ -300,63 +1942,571 @@ def api_get_sale(sale_id):
     return jsonify({'id':sale.id, 'customer_id':sale.customer_id, 'vehicle_id':sale.vehicle_id, 'total':sale.total, 'method':sale.method, 'timestamp':sale.timestamp.isoformat(), 'items': items})
 
 # List sales
+SALES_PAGE_MAX = 1000
+
+def parse_day(value, end=False):
+    """Parse YYYY-MM-DD into a datetime at the start of that day (or of the next day if end=True)."""
+    d = datetime.strptime(value, '%Y-%m-%d')
+    return d + timedelta(days=1) if end else d
+
+def sale_rows_query():
+    """Column-only sale query with customer name and reg_no joined in."""
+    return db.session.query(Sale.id, Sale.customer_id, Sale.vehicle_id, Sale.total, Sale.method, Sale.timestamp, Customer.name, Vehicle.reg_no) \
+        .outerjoin(Customer, Customer.id == Sale.customer_id) \
+        .outerjoin(Vehicle, Vehicle.id == Sale.vehicle_id)
+
+def sale_row_dict(row):
+    sid, cid, vid, total, method, ts, cname, reg_no = row
+    return {'id': sid, 'customer_id': cid, 'vehicle_id': vid, 'customer': cname, 'reg_no': reg_no, 'total': total, 'method': method, 'timestamp': ts.isoformat() if ts else None}
+
 @app.route('/api/sales', methods=['GET'])
 def api_list_sales():
-    sales = Sale.query.order_by(Sale.timestamp.desc()).limit(500).all()
+    """List sales newest first with customer name and reg_no in one joined query.
+
+    Query params (all optional):
+      limit=<n>              page size (default 500, max 1000)
+      before=<ts>,<id>       keyset cursor; returns sales strictly older than it
+      from=YYYY-MM-DD        first day (inclusive)
+      to=YYYY-MM-DD          last day (inclusive)
+      method=cash            payment method
+      customer_id=<id>
+    The cursor for the next page is returned in the X-Next-Cursor header
+    (absent on the last page).
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', 500)), 1), SALES_PAGE_MAX)
+        q = sale_rows_query()
+        if request.args.get('from'):
+            q = q.filter(Sale.timestamp >= parse_day(request.args['from']))
+        if request.args.get('to'):
+            q = q.filter(Sale.timestamp < parse_day(request.args['to'], end=True))
+        if request.args.get('method'):
+            q = q.filter(Sale.method == request.args['method'])
+        if request.args.get('customer_id'):
+            q = q.filter(Sale.customer_id == int(request.args['customer_id']))
+        if request.args.get('before'):
+            ts_str, _, id_str = request.args['before'].rpartition(',')
+            before_ts, before_id = datetime.fromisoformat(ts_str), int(id_str)
+            q = q.filter(db.or_(Sale.timestamp < before_ts, db.and_(Sale.timestamp == before_ts, Sale.id < before_id)))
+    except ValueError:
+        return jsonify({'error':'invalid limit, before, from, to or customer_id'}), 400
+
+    rows = q.order_by(Sale.timestamp.desc(), Sale.id.desc()).limit(limit).all()
+    if wants_ndjson():
+        resp = Response(b''.join(json_bytes(sale_row_dict(r)) + b'\n' for r in rows), mimetype='application/x-ndjson')
+    else:
+        resp = jsonify([sale_row_dict(r) for r in rows])
+    if len(rows) == limit:
+        last = rows[-1]
+        resp.headers['X-Next-Cursor'] = f'{last.timestamp.isoformat()},{last.id}'
+    return resp
+
+# Appointment slots. Each day's bookings are folded into a per-process occupancy
+# timeline (bookings per SLOT_STEP_MIN bucket between opening and closing time),
+# so finding free slots is a scan over a few dozen integers. A day's timeline is
+# rebuilt with one indexed query when appointments or service durations change.
+BAYS = int(os.getenv('CARWASH_BAYS', 2))
+OPEN_TIME = os.getenv('CARWASH_OPEN', '08:00')
+CLOSE_TIME = os.getenv('CARWASH_CLOSE', '20:00')
+SLOT_STEP_MIN = int(os.getenv('CARWASH_SLOT_MIN', 15))
+SHOP_UTC_OFFSET = int(os.environ['CARWASH_UTC_OFFSET']) if os.getenv('CARWASH_UTC_OFFSET') else None
+_day_schedules = {}  # date -> (appointments version, services version, DaySchedule)
+_booking_lock = threading.Lock()
+
+def shop_time(utc=None):
+    """Shop wall-clock time (naive) for a naive UTC datetime, default now.
+
+    Appointment times, opening hours and slots all use this clock, while sale
+    timestamps stay in UTC. CARWASH_UTC_OFFSET (minutes east of UTC, e.g. 330)
+    overrides the server's local timezone.
+    """
+    utc = utc or datetime.utcnow()
+    if SHOP_UTC_OFFSET is not None:
+        return utc + timedelta(minutes=SHOP_UTC_OFFSET)
+    return utc.replace(tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+
+def parse_appointment_time(value):
+    """Client ISO timestamp -> shop time; values without an offset are taken as shop time already."""
+    ts = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if ts.tzinfo is not None:
+        ts = shop_time(ts.astimezone(timezone.utc).replace(tzinfo=None))
+    return ts
+
+def _minutes(hhmm):
+    h, m = hhmm.split(':')
+    return int(h) * 60 + int(m)
+
+class DaySchedule:
+    """Bay occupancy for one day, bucketed by SLOT_STEP_MIN."""
+    def __init__(self, day, bays=BAYS, open_min=None, close_min=None, step=SLOT_STEP_MIN):
+        self.day = day
+        self.bays = bays
+        self.step = step
+        self.open_min = _minutes(OPEN_TIME) if open_min is None else open_min
+        self.close_min = _minutes(CLOSE_TIME) if close_min is None else close_min
+        self.counts = [0] * max((self.close_min - self.open_min) // step, 0)
+
+    def _buckets(self, start_min, duration):
+        first = max((start_min - self.open_min) // self.step, 0)
+        last = min(-(-(start_min + duration - self.open_min) // self.step), len(self.counts))  # ceil
+        return first, last
+
+    def add(self, start_min, duration):
+        first, last = self._buckets(start_min, duration)
+        for i in range(first, last):
+            self.counts[i] += 1
+
+    def free_bays(self, start_min, duration):
+        """Bays free for the whole of [start, start + duration); 0 outside opening hours."""
+        if start_min < self.open_min or start_min + duration > self.close_min:
+            return 0
+        first, last = self._buckets(start_min, duration)
+        return self.bays - max(self.counts[first:last], default=0)
+
+    def free_slots(self, duration):
+        """[(start minute, free bays)] for every bucket start where the service fits."""
+        out = []
+        for start in range(self.open_min, self.close_min - duration + 1, self.step):
+            free = self.free_bays(start, duration)
+            if free > 0:
+                out.append((start, free))
+        return out
+
+def load_day_bookings(day):
+    """[(start minute, duration)] of the day's non-cancelled appointments (one indexed range query)."""
+    start = datetime.combine(day, datetime.min.time())
+    rows = db.session.query(Appointment.scheduled_at, Service.duration_min) \
+        .join(Service, Service.id == Appointment.service_id) \
+        .filter(Appointment.scheduled_at >= start, Appointment.scheduled_at < start + timedelta(days=1),
+                db.or_(Appointment.status.is_(None), Appointment.status != 'cancelled')).all()
+    return [(ts.hour * 60 + ts.minute, dur or 30) for ts, dur in rows]
+
+def day_schedule(day):
+    versions = (table_version('appointments'), table_version('services'))
+    cached = _day_schedules.get(day)
+    if cached is not None and cached[:2] == versions:
+        return cached[2]
+    sched = DaySchedule(day)
+    for start_min, duration in load_day_bookings(day):
+        sched.add(start_min, duration)
+    if len(_day_schedules) > 60:
+        _day_schedules.clear()
+    _day_schedules[day] = versions + (sched,)
+    return sched
+
+def booking_fits(scheduled, duration):
+    """Whether a flushed, uncommitted appointment fits beside every other booking.
+
+    For bookings, call under _booking_lock after flush(): the flush holds
+    SQLite's write lock, so no other worker can commit a booking for the day
+    until we do.
+    """
+    check = DaySchedule(scheduled.date())
+    for other_start, other_duration in load_day_bookings(scheduled.date()):
+        check.add(other_start, other_duration)
+    start_min = scheduled.hour * 60 + scheduled.minute
+    return check.open_min <= start_min and start_min + duration <= check.close_min and check.free_bays(start_min, duration) >= 0
+
+def sale_appointment_fits(appt):
+    """Flush a sale's appointment and report whether it fits; it is kept either way.
+
+    Appointments created with a sale record a wash that is being paid for, like
+    the ones replayed by ingest_sales, so capacity is only reported, not enforced.
+    """
+    db.session.flush()
+    return booking_fits(appt.scheduled_at, service_duration(appt.service_id) or 30)
+
+def service_duration(service_id):
+    durations = service_catalog()[3]
+    if service_id in durations:
+        return durations[service_id]
+    return db.session.query(Service.duration_min).filter(Service.id == service_id).scalar()
+
+@app.route('/api/appointments/slots', methods=['GET'])
+def api_appointment_slots():
+    """Free start times for ?service_id= on ?date=YYYY-MM-DD given CARWASH_BAYS bays."""
+    try:
+        day = datetime.strptime(request.args['date'], '%Y-%m-%d').date()
+        service_id = int(request.args['service_id'])
+    except (KeyError, ValueError):
+        return jsonify({'error':'date (YYYY-MM-DD) and service_id params required'}), 400
+    duration = service_duration(service_id)
+    if duration is None:
+        return jsonify({'error':f'service id {service_id} not found'}), 404
+    sched = day_schedule(day)
+    return jsonify({'date': day.isoformat(), 'service_id': service_id, 'duration_min': duration, 'bays': sched.bays,
+                    'slots': [{'start': f'{m // 60:02d}:{m % 60:02d}', 'free_bays': free} for m, free in sched.free_slots(duration)]})
+
+@app.route('/api/appointments', methods=['POST'])
+def api_book_appointment():
+    """Book a bay: {"vehicle_id": 1 | "reg_no": "...", "service_id": 1, "scheduled_at": "YYYY-MM-DD HH:MM"}.
+
+    Returns 409 when no bay is free for the whole service duration. The capacity
+    check is repeated inside the write transaction, so concurrent bookings from
+    other workers cannot overbook.
+    """
+    data = request.get_json(force=True, silent=True) or {}
+    try:
+        service_id = int(data['service_id'])
+        scheduled = datetime.strptime(data['scheduled_at'], '%Y-%m-%d %H:%M')
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error':'service_id and scheduled_at (YYYY-MM-DD HH:MM) required'}), 400
+    duration = service_duration(service_id)
+    if duration is None:
+        return jsonify({'error':f'service id {service_id} not found'}), 400
+    start_min = scheduled.hour * 60 + scheduled.minute
+
+    with _booking_lock:
+        if day_schedule(scheduled.date()).free_bays(start_min, duration) <= 0:
+            return jsonify({'error':'no free bay at that time'}), 409
+        try:
+            veh = None
+            if data.get('vehicle_id'):
+                veh = Vehicle.query.get(int(data['vehicle_id']))
+            elif data.get('reg_no'):
+                veh = Vehicle.query.filter_by(reg_no=data['reg_no']).first()
+                if not veh:
+                    veh = Vehicle(reg_no=data['reg_no'], model=data.get('model'), customer_id=data.get('customer_id'))
+                    db.session.add(veh)
+            if veh is None:
+                return jsonify({'error':'vehicle_id or reg_no required'}), 400
+            appt = Appointment(service_id=service_id, scheduled_at=scheduled, status='scheduled', paid=False)
+            appt.vehicle = veh
+            db.session.add(appt)
+            db.session.flush()  # takes the write lock; re-check against committed bookings
+            if not booking_fits(scheduled, duration):
+                db.session.rollback()
+                return jsonify({'error':'no free bay at that time'}), 409
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    publish_appointment(appt)
+    return jsonify({'id': appt.id, 'vehicle_id': appt.vehicle_id, 'scheduled_at': scheduled.strftime('%Y-%m-%d %H:%M'), 'duration_min': duration}), 201
+
+def publish_appointment(appt):
+    events.publish('appointment', {'id': appt.id, 'vehicle_id': appt.vehicle_id, 'service_id': appt.service_id,
+                                   'scheduled_at': appt.scheduled_at.strftime('%Y-%m-%d %H:%M'), 'status': appt.status},
+                   [('appointments', appt.id)])
+
+# Delta sync for POS terminals
+SYNC_MAX_CHANGES = 5000
+SYNC_SNAPSHOT_SALES = 500
+SQL_IN_CHUNK = 500  # stay well below SQLite's bound-parameter limit
+
+def sync_rows(name, ids=None):
+    """Current rows of a synced table as dicts; all rows (latest sales only) when ids is None."""
+    if name == 'sales':
+        q, id_col = sale_rows_query(), Sale.id
+        to_dict = sale_row_dict
+    else:
+        cols = {
+            'services': (Service.id, Service.name, Service.price, Service.duration_min),
+            'customers': (Customer.id, Customer.name, Customer.phone, Customer.email),
+            'vehicles': (Vehicle.id, Vehicle.reg_no, Vehicle.model, Vehicle.customer_id),
+        }[name]
+        q, id_col = db.session.query(*cols), cols[0]
+        to_dict = lambda row: dict(zip((c.key for c in cols), row))
+    if ids is None:
+        if name == 'sales':
+            q = q.order_by(Sale.timestamp.desc(), Sale.id.desc()).limit(SYNC_SNAPSHOT_SALES)
+        return [to_dict(r) for r in q.all()]
+    ids = list(ids)
     out = []
-    for s in sales:
-        cust = Customer.query.get(s.customer_id)
-        veh = Vehicle.query.get(s.vehicle_id)
-        out.append({'id': s.id, 'customer': cust.name if cust else None, 'reg_no': veh.reg_no if veh else None, 'total': s.total, 'timestamp': s.timestamp.isoformat()})
+    for i in range(0, len(ids), SQL_IN_CHUNK):
+        out.extend(to_dict(r) for r in q.filter(id_col.in_(ids[i:i + SQL_IN_CHUNK])).all())
+    return out
+
+@app.route('/api/sync', methods=['GET'])
+def api_sync():
+    """Return services, customers, vehicles and sales changed since ?since=<token>.
+
+    Response: {"token": "...", "reset": bool, "more": bool,
+               "<table>": {"upserted": [...rows], "deleted": [ids]}, ...}
+    Without a (valid, still retained) token the client gets a full snapshot with
+    reset=true and should replace its state; otherwise it applies the deltas.
+    more=true means the delta was truncated: call again with the new token.
+    """
+    latest = db.session.query(db.func.max(ChangeLog.id)).scalar() or 0
+    since = request.args.get('since', '')
+    since = int(since) if since.isdigit() else None
+    if since is not None and (since > latest or since < change_log_pruned()):
+        since = None  # unknown or pruned token
+
+    if since is None:
+        out = {'token': str(latest), 'reset': True, 'more': False}
+        for name in SYNC_TABLES:
+            out[name] = {'upserted': sync_rows(name), 'deleted': []}
+        return jsonify(out)
+
+    changes = db.session.query(ChangeLog.id, ChangeLog.table, ChangeLog.row_id, ChangeLog.op) \
+        .filter(ChangeLog.id > since).order_by(ChangeLog.id).limit(SYNC_MAX_CHANGES).all()
+    last_op = {name: {} for name in SYNC_TABLES}
+    for _, table, row_id, op in changes:
+        if table in last_op:
+            last_op[table][row_id] = op
+    out = {'token': str(changes[-1].id if changes else since), 'reset': False, 'more': len(changes) == SYNC_MAX_CHANGES}
+    for name, ops in last_op.items():
+        rows = sync_rows(name, [rid for rid, op in ops.items() if op == 'upsert'])
+        found = {r['id'] for r in rows}
+        out[name] = {'upserted': rows, 'deleted': [rid for rid in ops if rid not in found]}
     return jsonify(out)
 
-# Simple reports
+# Reports (served from daily_sales_rollup)
+def rollup_summary(start_day, end_day):
+    """Aggregate rollup rows for start_day..end_day (inclusive) into totals and breakdowns."""
+    rows = db.session.query(DailySalesRollup.dim, DailySalesRollup.key, db.func.sum(DailySalesRollup.sale_count), db.func.sum(DailySalesRollup.qty), db.func.sum(DailySalesRollup.revenue)) \
+        .filter(DailySalesRollup.day >= start_day, DailySalesRollup.day <= end_day) \
+        .group_by(DailySalesRollup.dim, DailySalesRollup.key).all()
+    out = {'count': 0, 'total': 0, 'by_method': {}, 'by_service': {}}
+    for dim, key, cnt, qty, revenue in rows:
+        if dim == 'total':
+            out['count'], out['total'] = cnt, revenue
+        elif dim == 'method':
+            out['by_method'][key] = {'count': cnt, 'total': revenue}
+        elif dim == 'service':
+            out['by_service'][key] = {'lines': cnt, 'qty': qty, 'total': revenue}
+    return out
+
+def rollup_daily_totals(start_day, end_day):
+    """Return {day: (count, revenue)} for days that had sales in start_day..end_day."""
+    rows = db.session.query(DailySalesRollup.day, DailySalesRollup.sale_count, DailySalesRollup.revenue) \
+        .filter(DailySalesRollup.dim == 'total', DailySalesRollup.day >= start_day, DailySalesRollup.day <= end_day).all()
+    return {day: (cnt, revenue) for day, cnt, revenue in rows}
+
 @app.route('/api/reports/daily', methods=['GET'])
 def api_daily_report():
     date_str = request.args.get('date')  # YYYY-MM-DD
     if not date_str:
         return jsonify({'error':'date param required'}), 400
-    date_obj = datetime.strptime(date_str, '%Y-%m-%d').date()
-    total = db.session.query(db.func.sum(Sale.total)).filter(db.func.date(Sale.timestamp)==date_obj).scalar() or 0
-    cnt = Sale.query.filter(db.func.date(Sale.timestamp)==date_obj).count()
-    return jsonify({'date': date_str, 'count': cnt, 'total': total})
+    try:
+        date_obj = datetime.strptime(date_str, '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'error':'date must be YYYY-MM-DD'}), 400
+    out = {'date': date_str}
+    out.update(rollup_summary(date_obj, date_obj))
+    return jsonify(out)
 
+REPORT_GROUPS = ('day', 'week', 'month')
 
-# --- Visual Dashboard (HTML with Chart.js) ---
-@app.route('/dashboard')
-def dashboard():
-    cust_count = Customer.query.count()
-    vehicle_count = Vehicle.query.count()
-    service_count = Service.query.count()
-    sale_count = Sale.query.count()
+def report_bucket(day, group):
+    if group == 'week':
+        return (day - timedelta(days=day.weekday())).isoformat()  # Monday of the ISO week
+    if group == 'month':
+        return day.strftime('%Y-%m')
+    return day.isoformat()
+
+@app.route('/api/reports/range', methods=['GET'])
+def api_range_report():
+    """Sales between ?from= and ?to= (YYYY-MM-DD, inclusive) bucketed by ?group=day|week|month."""
+    group = request.args.get('group', 'day')
+    if group not in REPORT_GROUPS:
+        return jsonify({'error':'group must be day, week or month'}), 400
+    try:
+        start_day = datetime.strptime(request.args['from'], '%Y-%m-%d').date()
+        end_day = datetime.strptime(request.args['to'], '%Y-%m-%d').date()
+    except (KeyError, ValueError):
+        return jsonify({'error':'from and to params required (YYYY-MM-DD)'}), 400
+    if end_day < start_day:
+        return jsonify({'error':'to must not be before from'}), 400
+
+    buckets = {}
+    for day, (cnt, revenue) in sorted(rollup_daily_totals(start_day, end_day).items()):
+        b = buckets.setdefault(report_bucket(day, group), {'count': 0, 'total': 0.0})
+        b['count'] += cnt
+        b['total'] += revenue
+    out = {'from': start_day.isoformat(), 'to': end_day.isoformat(), 'group': group,
+           'buckets': [dict(period=k, **v) for k, v in buckets.items()]}
+    out.update(rollup_summary(start_day, end_day))
+    return jsonify(out)
+
+
+# Analytics over a date range: breakdowns come from the rollup, the hour x weekday
+# heatmap and customer stats from two grouped aggregates over the sale timestamp
+# index. Closed periods (ending before today) are memoized; the key includes the
+# period's rollup totals so a late offline sale replayed into the past still
+# shows up.
+ANALYTICS_MEMO_MAX = 256
+_analytics_memo = {}
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+
+def sale_range_filter(start_day, end_day):
+    start = datetime.combine(start_day, datetime.min.time())
+    return (Sale.timestamp >= start, Sale.timestamp < start + timedelta(days=(end_day - start_day).days + 1))
+
+def sales_heatmap(start_day, end_day, utc_offset=0):
+    """7x24 sale counts and revenue (Monday first) in local time = UTC + utc_offset minutes."""
+    ts = db.func.datetime(Sale.timestamp, f'{utc_offset:+d} minutes') if utc_offset else Sale.timestamp
+    weekday, hour = db.func.strftime('%w', ts), db.func.strftime('%H', ts)
+    in_range = sale_range_filter(start_day, end_day)
+    range_start = datetime.combine(start_day, datetime.min.time())
+    counts = [[0] * 24 for _ in WEEKDAYS]
+    revenue = [[0.0] * 24 for _ in WEEKDAYS]
+    for opts in sale_sources(range_start):
+        rows = db.session.query(weekday, hour, db.func.count(), db.func.sum(Sale.total)).execution_options(**opts) \
+            .filter(*in_range).group_by(weekday, hour).all()
+        for wd, hh, cnt, total in rows:
+            day = (int(wd) + 6) % 7  # SQLite's %w counts from Sunday
+            counts[day][int(hh)] += cnt
+            revenue[day][int(hh)] = round(revenue[day][int(hh)] + (total or 0.0), 2)
+    return {'weekdays': list(WEEKDAYS), 'count': counts, 'revenue': revenue}
+
+def customer_stats(start_day, end_day):
+    """Distinct, repeat (2+ visits in range) and returning (seen before range) customers, plus walk-ins."""
+    in_range = sale_range_filter(start_day, end_day)
+    range_start = datetime.combine(start_day, datetime.min.time())
+    sources = sale_sources(range_start)
+    history = sale_sources()  # earlier visits may be archived even when the range is not
+    if len(history) > 1:
+        return merged_customer_stats(range_start, in_range, sources, history)
+    per_customer = db.session.query(Sale.customer_id.label('cid'), db.func.count().label('visits')) \
+        .filter(Sale.customer_id.isnot(None), *in_range).group_by(Sale.customer_id).subquery()
+    earlier = db.select(Sale.id).where(Sale.customer_id == per_customer.c.cid, Sale.timestamp < range_start).exists()
+    customers, repeat, repeat_visits, returning = db.session.query(
+        db.func.count(), db.func.sum(db.case((per_customer.c.visits > 1, 1), else_=0)),
+        db.func.sum(db.case((per_customer.c.visits > 1, per_customer.c.visits), else_=0)),
+        db.func.sum(db.case((earlier, 1), else_=0)),
+    ).select_from(per_customer).one()
+    walk_ins = db.session.query(db.func.count()).filter(Sale.customer_id.is_(None), *in_range).scalar()
+    return {'customers': customers, 'repeat_customers': repeat or 0, 'repeat_visits': repeat_visits or 0,
+            'returning_customers': returning or 0, 'walk_in_sales': walk_ins,
+            'repeat_rate': round((repeat or 0) / customers, 4) if customers else 0.0}
+
+def merged_customer_stats(range_start, in_range, sources, history):
+    """customer_stats() across the live and archive databases, merged from per-customer visit counts.
+
+    `sources` hold the range's sales, `history` every sale (for returning customers).
+    """
+    visits, walk_ins = {}, 0
+    for opts in sources:
+        for cid, n in db.session.query(Sale.customer_id, db.func.count()).execution_options(**opts) \
+                .filter(Sale.customer_id.isnot(None), *in_range).group_by(Sale.customer_id):
+            visits[cid] = visits.get(cid, 0) + n
+        walk_ins += db.session.query(db.func.count()).execution_options(**opts).filter(Sale.customer_id.is_(None), *in_range).scalar()
+    returning = set()
+    ids = list(visits)
+    for opts in history:
+        for chunk in _in_chunks(ids):
+            returning.update(cid for cid, in db.session.query(Sale.customer_id).distinct().execution_options(**opts)
+                             .filter(Sale.customer_id.in_(chunk), Sale.timestamp < range_start))
+    repeat = [n for n in visits.values() if n > 1]
+    return {'customers': len(visits), 'repeat_customers': len(repeat), 'repeat_visits': sum(repeat),
+            'returning_customers': len(returning), 'walk_in_sales': walk_ins,
+            'repeat_rate': round(len(repeat) / len(visits), 4) if visits else 0.0}
+
+def compute_analytics(start_day, end_day, utc_offset=0):
+    summary = rollup_summary(start_day, end_day)
+    names = {str(s['id']): s['name'] for s in service_catalog()[1]}
+    count, total = summary['count'] or 0, summary['total'] or 0.0
+    return {
+        'from': start_day.isoformat(), 'to': end_day.isoformat(), 'utc_offset': utc_offset,
+        'count': count, 'total': total, 'avg_ticket': round(total / count, 2) if count else 0.0,
+        'by_service': sorted(({'service_id': int(k), 'name': names.get(k), **v} for k, v in summary['by_service'].items()),
+                             key=lambda r: -r['total']),
+        'by_method': sorted(({'method': k, **v, 'avg_ticket': round(v['total'] / v['count'], 2) if v['count'] else 0.0}
+                             for k, v in summary['by_method'].items()), key=lambda r: -r['total']),
+        'heatmap': sales_heatmap(start_day, end_day, utc_offset),
+        'customers': customer_stats(start_day, end_day),
+    }
+
+def analytics(start_day, end_day, utc_offset=0):
+    if end_day >= datetime.utcnow().date():
+        return compute_analytics(start_day, end_day, utc_offset)
+    totals = rollup_daily_totals(start_day, end_day).values()
+    key = (start_day, end_day, utc_offset, sum(c for c, _ in totals), round(sum(r or 0.0 for _, r in totals), 2),
+           table_version('services'), archive_cutoff())  # service names are part of the payload; archiving moves visits
+    result = _analytics_memo.get(key)
+    if result is None:
+        result = compute_analytics(start_day, end_day, utc_offset)
+        if len(_analytics_memo) >= ANALYTICS_MEMO_MAX:
+            _analytics_memo.clear()
+        _analytics_memo[key] = result
+    return result
+
+@app.route('/api/reports/analytics', methods=['GET'])
+def api_analytics_report():
+    """Revenue by service and method, hour x weekday heatmap and customer stats for ?from=&to= (inclusive).
+
+    Optional ?utc_offset=<minutes> shifts the heatmap to local time (e.g. 330 for IST).
+    """
+    try:
+        start_day = datetime.strptime(request.args['from'], '%Y-%m-%d').date()
+        end_day = datetime.strptime(request.args['to'], '%Y-%m-%d').date()
+        utc_offset = int(request.args.get('utc_offset', 0))
+    except (KeyError, ValueError):
+        return jsonify({'error':'from and to params required (YYYY-MM-DD); utc_offset in minutes'}), 400
+    if end_day < start_day:
+        return jsonify({'error':'to must not be before from'}), 400
+    if not -840 <= utc_offset <= 840:
+        return jsonify({'error':'utc_offset must be between -840 and 840 minutes'}), 400
+    return jsonify(analytics(start_day, end_day, utc_offset))
+
+# --- Dashboard metrics (cached) ---
+DASHBOARD_TTL = float(os.getenv('CARWASH_DASHBOARD_TTL', 30))
+DASHBOARD_DAYS = 30
+_dashboard_cache = None  # (payload, monotonic expiry)
+_dashboard_lock = threading.Lock()
+
+def compute_dashboard_metrics():
+    """Counts, the 30-day revenue series and recent activity in a handful of small queries."""
+    counts = db.session.query(
+        db.select(db.func.count()).select_from(Customer).scalar_subquery(),
+        db.select(db.func.count()).select_from(Vehicle).scalar_subquery(),
+        db.select(db.func.coalesce(db.func.sum(DailySalesRollup.sale_count), 0)).where(DailySalesRollup.dim == 'total').scalar_subquery(),
+    ).one()
 
-    N = 30
     today = datetime.utcnow().date()
-    start = today - timedelta(days=N-1)
-    date_map = { (start + timedelta(days=i)).isoformat(): 0.0 for i in range(N) }
+    start = today - timedelta(days=DASHBOARD_DAYS-1)
+    date_map = { (start + timedelta(days=i)).isoformat(): 0.0 for i in range(DASHBOARD_DAYS) }
+    for day, (_, revenue) in rollup_daily_totals(start, today).items():
+        date_map[day.isoformat()] = float(revenue or 0.0)
 
-    sales = Sale.query.filter(Sale.timestamp >= datetime.combine(start, datetime.min.time())).all()
-    for s in sales:
-        if s.timestamp:
-            d = s.timestamp.date().isoformat()
-            if d in date_map:
-                date_map[d] += float(s.total or 0.0)
+    recent_sales = db.session.query(Sale.id, Sale.total, Sale.timestamp).order_by(Sale.timestamp.desc(), Sale.id.desc()).limit(20).all()
+    recent_customers = db.session.query(Customer.id, Customer.name, Customer.phone).order_by(Customer.id.desc()).limit(20).all()
+    return {
+        'counts': {'customers': counts[0], 'vehicles': counts[1], 'services': len(service_catalog()[1]), 'sales': counts[2]},
+        'days': DASHBOARD_DAYS,
+        'labels': list(date_map.keys()),
+        'data': list(date_map.values()),
+        'recent_sales': [{'id': sid, 'total': total, 'timestamp': ts.isoformat() if ts else None} for sid, total, ts in recent_sales],
+        'recent_customers': [{'id': cid, 'name': name, 'phone': phone} for cid, name, phone in recent_customers],
+        'generated_at': datetime.utcnow().isoformat(),
+    }
 
-    labels = list(date_map.keys())
-    data = [date_map[d] for d in labels]
+def dashboard_metrics():
+    """Cached dashboard payload; recomputed after DASHBOARD_TTL seconds or once data changes."""
+    global _dashboard_cache
+    cached = _dashboard_cache
+    if cached is not None and time.monotonic() < cached[1]:
+        return cached[0]
+    with _dashboard_lock:
+        if _dashboard_cache is None or time.monotonic() >= _dashboard_cache[1]:
+            _dashboard_cache = (compute_dashboard_metrics(), time.monotonic() + DASHBOARD_TTL)
+        return _dashboard_cache[0]
 
-    recent_sales = Sale.query.order_by(Sale.timestamp.desc()).limit(20).all()
-    recent_customers = Customer.query.order_by(Customer.id.desc()).limit(20).all()
+@app.route('/api/dashboard/metrics', methods=['GET'])
+def api_dashboard_metrics():
+    resp = jsonify(dashboard_metrics())
+    resp.headers['Cache-Control'] = f'max-age={int(DASHBOARD_TTL)}'
+    return resp
+
+# --- Visual Dashboard (HTML with Chart.js) ---
+@app.route('/dashboard')
+def dashboard():
+    m = dashboard_metrics()
+    cust_count, vehicle_count, service_count, sale_count = (m['counts'][k] for k in ('customers', 'vehicles', 'services', 'sales'))
+    N = m['days']
+    labels, data = m['labels'], m['data']
 
     recent_sales_html = '\n'.join([
-        f"<li class='list-group-item'>#{s.id} — ₹{int(s.total or 0)} — {s.timestamp.strftime('%Y-%m-%d %H:%M')}</li>"
-        for s in recent_sales
-    ]) if recent_sales else '<li class="list-group-item">No sales</li>'
+        f"<li class='list-group-item'>#{s['id']} — ₹{int(s['total'] or 0)} — {s['timestamp'][:16].replace('T', ' ') if s['timestamp'] else ''}</li>"
+        for s in m['recent_sales']
+    ]) if m['recent_sales'] else '<li class="list-group-item empty">No sales</li>'
 
     recent_customers_html = '\n'.join([
-        f"<li class='list-group-item'>{c.id} — {c.name} — {c.phone or ''}</li>"
-        for c in recent_customers
-    ]) if recent_customers else '<li class="list-group-item">No customers</li>'
+        f"<li class='list-group-item'>{c['id']} — {escape(c['name'])} — {escape(c['phone'] or '')}</li>"
+        for c in m['recent_customers']
+    ]) if m['recent_customers'] else '<li class="list-group-item">No customers</li>'
 
     labels_json = json.dumps(labels)
     data_json = json.dumps(data)
@@ -379,10 +2529,10 @@ def dashboard():
         </div>
 
         <div class="row mb-3">
-            <div class="col-md-3"><div class="card p-3">Customers<br><strong>{cust_count}</strong></div></div>
-            <div class="col-md-3"><div class="card p-3">Vehicles<br><strong>{vehicle_count}</strong></div></div>
-            <div class="col-md-3"><div class="card p-3">Services<br><strong>{service_count}</strong></div></div>
-            <div class="col-md-3"><div class="card p-3">Sales<br><strong>{sale_count}</strong></div></div>
+            <div class="col-md-3"><div class="card p-3">Customers<br><strong id="count-customers">{cust_count}</strong></div></div>
+            <div class="col-md-3"><div class="card p-3">Vehicles<br><strong id="count-vehicles">{vehicle_count}</strong></div></div>
+            <div class="col-md-3"><div class="card p-3">Services<br><strong id="count-services">{service_count}</strong></div></div>
+            <div class="col-md-3"><div class="card p-3">Sales<br><strong id="count-sales">{sale_count}</strong></div></div>
         </div>
 
         <div class="card mb-3 p-3">
@@ -394,7 +2544,7 @@ def dashboard():
             <div class="col-md-6">
                 <div class="card p-3 mb-3">
                     <h6>Recent Sales</h6>
-                    <ul class="list-group">
+                    <ul class="list-group" id="recentSales">
                     {recent_sales_html}
                     </ul>
                 </div>
@@ -402,7 +2552,7 @@ def dashboard():
             <div class="col-md-6">
                 <div class="card p-3 mb-3">
                     <h6>Recent Customers</h6>
-                    <ul class="list-group">
+                    <ul class="list-group" id="recentCustomers">
                     {recent_customers_html}
                     </ul>
                 </div>
@@ -414,11 +2564,56 @@ def dashboard():
         const labels = {labels_json};
         const data = {data_json};
         const ctx = document.getElementById('salesChart');
-        new Chart(ctx, {{
+        const chart = new Chart(ctx, {{
             type: 'line',
             data: {{ labels: labels, datasets: [{{ label: 'Daily sales', data: data, borderColor: 'rgb(75, 192, 192)', tension: 0.2, fill: true }}] }},
             options: {{ scales: {{ x: {{ display: true }}, y: {{ beginAtZero: true }} }} }}
         }});
+
+        // Live updates: new sales are applied in place; anything else refetches the cached metrics
+        function item(text){{ const li = document.createElement('li'); li.className = 'list-group-item'; li.textContent = text; return li; }}
+        function saleText(s){{ return `#${{s.id}} — ₹${{Math.trunc(s.total || 0)}} — ${{s.timestamp ? s.timestamp.slice(0, 16).replace('T', ' ') : ''}}`; }}
+        function fillList(id, rows, text, empty){{
+            const ul = document.getElementById(id);
+            ul.replaceChildren(...(rows.length ? rows.map(r => item(text(r))) : [item(empty)]));
+        }}
+        let refreshTimer = null;
+        function refresh(){{
+            clearTimeout(refreshTimer);
+            refreshTimer = setTimeout(async () => {{
+                const res = await fetch('/api/dashboard/metrics', {{cache: 'no-store'}});
+                if(!res.ok) return;
+                const m = await res.json();
+                for(const k in m.counts) document.getElementById('count-' + k).textContent = m.counts[k];
+                fillList('recentSales', m.recent_sales, saleText, 'No sales');
+                fillList('recentCustomers', m.recent_customers, c => `${{c.id}} — ${{c.name}} — ${{c.phone || ''}}`, 'No customers');
+                chart.data.labels = m.labels;
+                chart.data.datasets[0].data = m.data;
+                chart.update();
+            }}, 1000);
+        }}
+        let lost = false;
+        function subscribe(){{
+            const es = new EventSource('/api/events');
+            es.onopen = () => {{ if(lost){{ lost = false; refresh(); }} }};
+            // a refused stream (server at its stream limit) is not retried by the browser:
+            // catch up from the metrics and try again later, so the screen keeps updating
+            es.onerror = () => {{ if(es.readyState === EventSource.CLOSED){{ lost = true; refresh(); setTimeout(subscribe, 60000); }} }};
+            es.addEventListener('sale', e => {{
+                const s = JSON.parse(e.data);
+                const count = document.getElementById('count-sales');
+                count.textContent = Number(count.textContent) + 1;
+                const ul = document.getElementById('recentSales');
+                ul.querySelector('.empty')?.remove();
+                ul.prepend(item(saleText(s)));
+                while(ul.children.length > 20) ul.lastElementChild.remove();
+                const i = chart.data.labels.indexOf(s.timestamp.slice(0, 10));
+                if(i >= 0){{ chart.data.datasets[0].data[i] += s.total || 0; chart.update(); }}
+            }});
+            ['service', 'sale_batch', 'changed', 'resync'].forEach(t => es.addEventListener(t, refresh));
+        }}
+        if(window.EventSource) subscribe();
+        else setInterval(refresh, 60000);
     </script>
 </body>
 </html>
@@ -427,61 +2622,321 @@ def dashboard():
     return html
 
 
-# --- Excel export (XLSX) ---
+# --- Excel / CSV export ---
+# Sheet name -> (header row, id column used for batching, date column for ?from=&to=, column-only query)
+EXPORT_SHEETS = {
+    'Customers': (['id','name','phone','email'], Customer.id, None,
+                  lambda: db.session.query(Customer.id, Customer.name, Customer.phone, Customer.email)),
+    'Vehicles': (['id','reg_no','model','customer_id'], Vehicle.id, None,
+                 lambda: db.session.query(Vehicle.id, Vehicle.reg_no, Vehicle.model, Vehicle.customer_id)),
+    'Services': (['id','name','price'], Service.id, None,
+                 lambda: db.session.query(Service.id, Service.name, Service.price)),
+    'Sales': (['sale_id','customer_id','vehicle_id','total','method','timestamp'], Sale.id, Sale.timestamp,
+              lambda: db.session.query(Sale.id, Sale.customer_id, Sale.vehicle_id, Sale.total, Sale.method, Sale.timestamp)),
+    'SaleItems': (['id','sale_id','service_id','qty','price','line_total'], SaleItem.id, Sale.timestamp,
+                  lambda: db.session.query(SaleItem.id, SaleItem.sale_id, SaleItem.service_id, SaleItem.qty, SaleItem.price, SaleItem.line_total).join(Sale, Sale.id == SaleItem.sale_id)),
+    'Appointments': (['id','vehicle_id','service_id','scheduled_at','status','paid'], Appointment.id, Appointment.scheduled_at,
+                     lambda: db.session.query(Appointment.id, Appointment.vehicle_id, Appointment.service_id, Appointment.scheduled_at, Appointment.status, Appointment.paid)),
+    'Payments': (['id','appointment_id','amount','method','timestamp'], Payment.id, Payment.timestamp,
+                 lambda: db.session.query(Payment.id, Payment.appointment_id, Payment.amount, Payment.method, Payment.timestamp)),
+}
+EXPORT_BATCH_SIZE = 2000
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+def parse_export_args(args):
+    """Read ?sheets=&from=&to= into (sheet names, start, end); raises ValueError on bad input."""
+    names = [n.strip() for n in args.get('sheets', '').split(',') if n.strip()] or list(EXPORT_SHEETS)
+    unknown = [n for n in names if n not in EXPORT_SHEETS]
+    if unknown:
+        raise ValueError(f'unknown sheets: {", ".join(unknown)}')
+    start = parse_day(args['from']) if args.get('from') else None
+    end = parse_day(args['to'], end=True) if args.get('to') else None
+    return names, start, end
+
+def iter_export_rows(name, start=None, end=None, batch_size=EXPORT_BATCH_SIZE):
+    """Yield one sheet's rows (already formatted for output) using id-keyset batches.
+
+    Archived sheets read the archive first when the range reaches back past the cutoff.
+    """
+    _, id_col, date_col, make_query = EXPORT_SHEETS[name]
+    sources = sale_sources(start) if id_col.table in _ARCHIVED_TABLE_SET else [{}]
+    for opts in sources:
+        last_id = 0
+        while True:
+            q = make_query().execution_options(**opts).filter(id_col > last_id)
+            if date_col is not None and start is not None:
+                q = q.filter(date_col >= start)
+            if date_col is not None and end is not None:
+                q = q.filter(date_col < end)
+            rows = q.order_by(id_col).limit(batch_size).all()
+            for row in rows:
+                yield [v.isoformat() if isinstance(v, datetime) else ('' if v is None else v) for v in row]
+            if len(rows) < batch_size:
+                break
+            last_id = rows[-1][0]
+
+class _ChunkSink(io.RawIOBase):
+    """Unseekable write target that hands out what has been written so far."""
+    def __init__(self):
+        self._chunks = []
+    def writable(self):
+        return True
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def stream_file(path, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield a file in chunks and delete it once sent."""
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(path)
+
+def export_filename(ext, start, end):
+    suffix = ''
+    if start or end:
+        suffix = '_' + (start.date().isoformat() if start else '') + '_' + ((end - timedelta(days=1)).date().isoformat() if end else '')
+    return f'carwash_export{suffix}.{ext}'
+
+def write_xlsx(path, names, start=None, end=None):
+    from openpyxl import Workbook  # imported on first export to keep worker startup light
+    wb = Workbook(write_only=True)
+    for name in names:
+        ws = wb.create_sheet(name)
+        ws.append(EXPORT_SHEETS[name][0])
+        for row in iter_export_rows(name, start, end):
+            ws.append(row)
+    wb.save(path)
+
+def iter_zip_chunks(names, start=None, end=None):
+    """Yield a ZIP of one CSV per sheet as it is written."""
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for name in names:
+            with zf.open(f'{name}.csv', 'w', force_zip64=True) as raw:
+                out = io.TextIOWrapper(raw, encoding='utf-8', newline='')
+                writer = csv.writer(out)
+                writer.writerow(EXPORT_SHEETS[name][0])
+                for i, row in enumerate(iter_export_rows(name, start, end), 1):
+                    writer.writerow(row)
+                    if i % EXPORT_BATCH_SIZE == 0:
+                        out.flush()
+                        data = sink.drain()
+                        if data:
+                            yield data
+                out.flush()
+                out.detach()
+            data = sink.drain()
+            if data:
+                yield data
+    yield sink.drain()
+
+def write_zip(path, names, start=None, end=None):
+    with open(path, 'wb') as f:
+        for chunk in iter_zip_chunks(names, start, end):
+            f.write(chunk)
+
 @app.route('/export/all.xlsx')
 def export_all_xlsx():
-    wb = Workbook()
-    # remove default sheet
-    default = wb.active
-    wb.remove(default)
-
-    # Customers
-    ws = wb.create_sheet('Customers')
-    ws.append(['id','name','phone','email'])
-    for c in Customer.query.order_by(Customer.id).all():
-        ws.append([c.id, c.name, c.phone or '', c.email or ''])
-
-    # Vehicles
-    ws = wb.create_sheet('Vehicles')
-    ws.append(['id','reg_no','model','customer_id'])
-    for v in Vehicle.query.order_by(Vehicle.id).all():
-        ws.append([v.id, v.reg_no, v.model or '', v.customer_id or ''])
-
-    # Services
-    ws = wb.create_sheet('Services')
-    ws.append(['id','name','price'])
-    for s in Service.query.order_by(Service.id).all():
-        ws.append([s.id, s.name, s.price])
-
-    # Sales
-    ws = wb.create_sheet('Sales')
-    ws.append(['sale_id','customer_id','vehicle_id','total','method','timestamp'])
-    for sale in Sale.query.order_by(Sale.id).all():
-        ws.append([sale.id, sale.customer_id or '', sale.vehicle_id or '', sale.total or 0.0, sale.method or '', sale.timestamp.isoformat() if sale.timestamp else ''])
-
-    # SaleItems
-    ws = wb.create_sheet('SaleItems')
-    ws.append(['id','sale_id','service_id','qty','price','line_total'])
-    for si in SaleItem.query.order_by(SaleItem.id).all():
-        ws.append([si.id, si.sale_id, si.service_id, si.qty, si.price, si.line_total])
-
-    # Appointments
-    ws = wb.create_sheet('Appointments')
-    ws.append(['id','vehicle_id','service_id','scheduled_at','status','paid'])
-    for a in Appointment.query.order_by(Appointment.id).all():
-        ws.append([a.id, a.vehicle_id, a.service_id, a.scheduled_at.isoformat() if a.scheduled_at else '', a.status, bool(a.paid)])
-
-    # Payments
-    ws = wb.create_sheet('Payments')
-    ws.append(['id','appointment_id','amount','method','timestamp'])
-    for p in Payment.query.order_by(Payment.id).all():
-        ws.append([p.id, p.appointment_id or '', p.amount, p.method or '', p.timestamp.isoformat() if p.timestamp else ''])
-
-    # Save to bytes
-    bio = io.BytesIO()
-    wb.save(bio)
-    bio.seek(0)
-    return send_file(bio, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', as_attachment=True, download_name='carwash_export.xlsx')
+    """Excel export built with write-only sheets from batched column queries.
+
+    Optional ?sheets=Sales,SaleItems and ?from=YYYY-MM-DD&to=YYYY-MM-DD (applied
+    to the dated sheets). The workbook is assembled in a temp file, never in
+    memory, and streamed to the client in chunks.
+    """
+    try:
+        names, start, end = parse_export_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    def generate():
+        fd, path = tempfile.mkstemp(suffix='.xlsx', dir=INSTANCE_PATH)
+        os.close(fd)
+        try:
+            write_xlsx(path, names, start, end)
+        except Exception:
+            os.remove(path)
+            raise
+        yield from stream_file(path)
+
+    return Response(stream_with_context(generate()), mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                    headers={'Content-Disposition': f'attachment; filename={export_filename("xlsx", start, end)}'})
+
+@app.route('/export/all.zip')
+def export_all_zip():
+    """Cheaper export: one CSV per sheet inside a ZIP, streamed while rows are read.
+
+    Accepts the same ?sheets=&from=&to= parameters as /export/all.xlsx.
+    """
+    try:
+        names, start, end = parse_export_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return Response(stream_with_context(iter_zip_chunks(names, start, end)), mimetype='application/zip',
+                    headers={'Content-Disposition': f'attachment; filename={export_filename("zip", start, end)}'})
+
+# --- Background export jobs ---
+# Exports run on a small thread pool instead of the request thread. A job's id is
+# a hash of its parameters and the versions of the tables it reads, so asking for
+# the same export again while the data is unchanged returns the finished file at
+# once. Status and results live under instance/exports/ (<id>.json, <id>.<ext>),
+# which lets any worker process answer a poll or serve the download.
+JOB_DIR = os.path.join(INSTANCE_PATH, 'exports')
+JOB_WORKERS = int(os.getenv('CARWASH_JOB_WORKERS', 2))
+JOB_QUEUE_MAX = int(os.getenv('CARWASH_JOB_QUEUE', 8))       # queued + running jobs per process
+JOB_STALE_AFTER = int(os.getenv('CARWASH_JOB_TIMEOUT', 900))  # seconds before a 'running' job is presumed dead
+JOB_KEEP_HOURS = float(os.getenv('CARWASH_JOB_KEEP_HOURS', 24))
+EXPORT_FORMATS = {
+    'xlsx': (write_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'zip': (write_zip, 'application/zip'),
+}
+# sheet -> change_log table whose version keys the cached result
+EXPORT_SHEET_TABLES = {'Customers': 'customers', 'Vehicles': 'vehicles', 'Services': 'services', 'Sales': 'sales',
+                       'SaleItems': 'sales', 'Appointments': 'appointments', 'Payments': 'payments'}
+_job_pool = None
+_job_pool_lock = threading.Lock()
+_jobs_active = set()  # ids queued or running in this process
+
+def job_pool():
+    global _job_pool
+    with _job_pool_lock:
+        if _job_pool is None:
+            from concurrent.futures import ThreadPoolExecutor
+            _job_pool = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='carwash-job')
+        return _job_pool
+
+def export_job_id(fmt, names, start, end):
+    versions = {t: table_version(t) for t in sorted({EXPORT_SHEET_TABLES[n] for n in names})}
+    key = json.dumps([fmt, names, start and start.isoformat(), end and end.isoformat(), versions])
+    return hashlib.sha1(key.encode()).hexdigest()[:20]
+
+def _job_path(job_id, ext='json'):
+    return os.path.join(JOB_DIR, f'{job_id}.{ext}')
+
+def _job_tmp_path(job_id, ext):
+    """Scratch file for one writer; workers racing on the same job never share it."""
+    return _job_path(job_id, f'{ext}.{os.getpid()}.{threading.get_ident()}.part')
+
+def read_job(job_id):
+    try:
+        with open(_job_path(job_id)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_job(job):
+    """Persist job status atomically so other workers never read a half-written file."""
+    job['updated'] = time.time()
+    tmp = _job_tmp_path(job['id'], 'json')
+    with open(tmp, 'w') as f:
+        json.dump(job, f)
+    os.replace(tmp, _job_path(job['id']))
+
+def job_is_live(job):
+    if job['status'] in ('queued', 'running'):
+        return job['id'] in _jobs_active or time.time() - job.get('updated', 0) < JOB_STALE_AFTER
+    return job['status'] == 'done' and os.path.exists(_job_path(job['id'], job['format']))
+
+def run_export_job(job, names, start, end):
+    writer = EXPORT_FORMATS[job['format']][0]
+    path = _job_path(job['id'], job['format'])
+    tmp = _job_tmp_path(job['id'], job['format'])
+    try:
+        job['status'] = 'running'
+        write_job(job)
+        with app.app_context():
+            writer(tmp, names, start, end)
+        os.replace(tmp, path)
+        job.update(status='done', size=os.path.getsize(path), finished=time.time())
+    except Exception as e:
+        app.logger.exception('export job %s failed', job['id'])
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        job.update(status='failed', error=str(e), finished=time.time())
+    finally:
+        write_job(job)
+        _jobs_active.discard(job['id'])
+
+def prune_job_files():
+    cutoff = time.time() - JOB_KEEP_HOURS * 3600
+    for entry in os.scandir(JOB_DIR):
+        job_id = entry.name.split('.', 1)[0]
+        if job_id not in _jobs_active and entry.stat().st_mtime < cutoff:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+def job_status(job):
+    out = {k: job.get(k) for k in ('id', 'status', 'format', 'created', 'finished', 'size', 'error')}
+    if job['status'] == 'done':
+        out['download'] = url_for('api_job_download', job_id=job['id'])
+    return out
+
+@app.route('/api/jobs/export', methods=['POST'])
+def api_job_export():
+    """Queue an export: {"format": "xlsx"|"zip", "sheets": [...], "from": "YYYY-MM-DD", "to": "YYYY-MM-DD"}.
+
+    Returns 202 with the job while it is pending, or 200 when an identical export
+    of the current data already exists. Poll GET /api/jobs/<id>.
+    """
+    data = request.get_json(force=True, silent=True) or {}
+    fmt = data.get('format', 'xlsx')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f'format must be one of {", ".join(EXPORT_FORMATS)}'}), 400
+    sheets = data.get('sheets') or ''
+    args = {'sheets': ','.join(sheets) if isinstance(sheets, list) else sheets, 'from': data.get('from'), 'to': data.get('to')}
+    try:
+        names, start, end = parse_export_args(args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    os.makedirs(JOB_DIR, exist_ok=True)
+    job_id = export_job_id(fmt, names, start, end)
+    with _job_pool_lock:
+        job = read_job(job_id)
+        if job is not None and job_is_live(job):
+            return jsonify(job_status(job)), 200 if job['status'] == 'done' else 202
+        if len(_jobs_active) >= JOB_QUEUE_MAX:
+            return jsonify({'error': 'too many export jobs in progress, try again shortly'}), 503, {'Retry-After': '5'}
+        job = {'id': job_id, 'status': 'queued', 'format': fmt, 'created': time.time()}
+        write_job(job)
+        _jobs_active.add(job_id)
+    prune_job_files()
+    body = job_status(job)
+    job_pool().submit(run_export_job, job, names, start, end)
+    return jsonify(body), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def api_job(job_id):
+    job = read_job(job_id) if re.fullmatch(r'[0-9a-f]{20}', job_id) else None
+    if job is None:
+        return jsonify({'error': 'job not found'}), 404
+    if not job_is_live(job) and job['status'] != 'failed':
+        job = dict(job, status='failed', error=job.get('error') or 'job was interrupted or its result expired')
+    return jsonify(job_status(job))
+
+@app.route('/api/jobs/<job_id>/download', methods=['GET'])
+def api_job_download(job_id):
+    job = read_job(job_id) if re.fullmatch(r'[0-9a-f]{20}', job_id) else None
+    if job is None or job['status'] != 'done':
+        return jsonify({'error': 'export not ready'}), 404
+    fmt = job['format']
+    path = _job_path(job_id, fmt)
+    if not os.path.exists(path):
+        return jsonify({'error': 'export expired, queue it again'}), 410
+    return send_file(path, mimetype=EXPORT_FORMATS[fmt][1], as_attachment=True,
+                     download_name=f'carwash_export_{job_id[:8]}.{fmt}', conditional=True)
 
 # Run
 if __name__ == '__main__':
@@ -0,0 +1,11 @@
+"""Benchmarks for the Car Wash POS backend.
+
+    python -m bench generate --sales 100000 --db instance/bench-100k.db
+    python -m bench run --db instance/bench-100k.db --out results-100k.json
+    python -m bench compare results-old.json results-new.json
+
+`generate` bulk-loads a deterministic synthetic data set into a scratch SQLite
+database, `run` drives every API endpoint through the Flask test client and
+writes latency percentiles, throughput, SQL statement counts and memory to
+JSON, and `compare` flags endpoints that got slower between two result files.
+"""
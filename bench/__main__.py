@@ -0,0 +1,57 @@
+import argparse
+import os
+import sys
+from datetime import datetime
+
+from bench import datagen, driver
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bench', description='Car Wash POS benchmarks')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    gen = sub.add_parser('generate', help='create a scratch database with synthetic data')
+    gen.add_argument('--db', required=True, help='SQLite file to create (must not exist)')
+    gen.add_argument('--sales', default='10k', help='number of sales, or one of: ' + ', '.join(datagen.SIZES))
+    gen.add_argument('--seed', type=int, default=42)
+    gen.add_argument('--days', type=int, default=365, help='days of history')
+    gen.add_argument('--end-date', help='last day of history, YYYY-MM-DD (default: today)')
+
+    run = sub.add_parser('run', help='benchmark every endpoint against a database')
+    run.add_argument('--db', required=True)
+    run.add_argument('--out', required=True, help='JSON results file')
+    run.add_argument('--iterations', type=int, default=50)
+    run.add_argument('--heavy-iterations', type=int, default=3, help='iterations for exports and full sync')
+    run.add_argument('--threads', type=int, default=1, help='concurrent client threads')
+    run.add_argument('--only', action='append', help='only endpoints whose name contains this (repeatable)')
+
+    cmp_ = sub.add_parser('compare', help='compare two result files')
+    cmp_.add_argument('old')
+    cmp_.add_argument('new')
+    cmp_.add_argument('--metric', default='p95_ms')
+    cmp_.add_argument('--threshold', type=float, default=1.2, help='ratio above which a change counts as a regression')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate':
+        if os.path.exists(args.db):
+            parser.error(f'{args.db} already exists')
+        sales = datagen.SIZES.get(args.sales.lower()) or int(args.sales)
+        end = datetime.strptime(args.end_date, '%Y-%m-%d').date() if args.end_date else None
+        counts = datagen.generate(args.db, sales=sales, seed=args.seed, days=args.days, end_date=end)
+        print(', '.join(f'{k}={v}' for k, v in counts.items()))
+        return 0
+
+    if args.command == 'run':
+        results = driver.run(args.db, iterations=args.iterations, heavy_iterations=args.heavy_iterations,
+                             threads=args.threads, only=args.only)
+        driver.write_results(results, args.out)
+        print(f'results written to {args.out}')
+        return 0
+
+    regressions = driver.compare(args.old, args.new, metric=args.metric, threshold=args.threshold)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
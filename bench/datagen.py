@@ -0,0 +1,121 @@
+"""Deterministic synthetic data for benchmarking.
+
+The same seed, size and end date always produce the same rows. Data is written
+with sqlite3 executemany straight into a database whose schema was created by
+app.init_db(), then the daily rollup is rebuilt.
+"""
+import random
+import sqlite3
+from datetime import datetime, timedelta
+
+SIZES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+
+SERVICES = [
+    ('Exterior Wash', 150.0), ('Full Wash + Interior', 400.0), ('Polish & Wax', 700.0),
+    ('Underbody Wash', 250.0), ('Engine Bay Clean', 350.0), ('Interior Vacuum', 200.0),
+    ('Ceramic Coating', 4500.0), ('Headlight Restoration', 600.0), ('Tyre Shine', 100.0),
+    ('Upholstery Shampoo', 900.0), ('Bike Wash', 80.0), ('Odour Treatment', 450.0),
+]
+FIRST = ['Aarav', 'Vivaan', 'Aditya', 'Rahul', 'Priya', 'Ananya', 'Sneha', 'Rohan', 'Kavya', 'Arjun',
+         'Ishaan', 'Meera', 'Neha', 'Vikram', 'Pooja', 'Sanjay', 'Divya', 'Karan', 'Nisha', 'Amit']
+LAST = ['Sharma', 'Patil', 'Kulkarni', 'Deshmukh', 'Joshi', 'Rao', 'Iyer', 'Verma', 'Gupta', 'Shah',
+        'Naik', 'Pawar', 'Reddy', 'Mehta', 'Singh', 'Kapoor', 'Chavan', 'Bhat', 'Menon', 'Das']
+MODELS = ['Swift', 'City', 'Creta', 'Nexon', 'Baleno', 'Innova', 'XUV700', 'i20', 'Seltos', 'Dzire']
+STATES = ['MH', 'KA', 'DL', 'GJ', 'TN', 'TS']
+METHODS = (['cash'] * 5) + (['upi'] * 4) + ['card']
+# busier late morning and evening
+HOUR_WEIGHTS = [0, 0, 0, 0, 0, 0, 1, 3, 6, 9, 10, 9, 7, 6, 6, 7, 9, 10, 8, 5, 3, 1, 0, 0]
+CHUNK = 50_000
+
+
+def _reg_no(i):
+    letters = chr(65 + (i // 10000) % 26) + chr(65 + (i // 260000) % 26)
+    return f'{STATES[i % len(STATES)]}{(i // 7) % 50 + 1:02d}{letters}{i % 10000:04d}'
+
+
+def _ts(dt):
+    return dt.strftime('%Y-%m-%d %H:%M:%S.%f')  # SQLAlchemy's SQLite DateTime format
+
+
+def _insert(conn, sql, rows):
+    for i in range(0, len(rows), CHUNK):
+        conn.executemany(sql, rows[i:i + CHUNK])
+
+
+def generate(db_path, sales=10_000, seed=42, days=365, end_date=None):
+    """Create the schema at db_path and fill it; returns row counts per table."""
+    import os
+    os.environ['CARWASH_DB_PATH'] = os.path.abspath(db_path)
+    from app import app, init_db, rebuild_sales_rollup
+
+    rng = random.Random(seed)
+    end = datetime.combine(end_date or datetime.utcnow().date(), datetime.min.time())
+    start = end - timedelta(days=days - 1)
+
+    with app.app_context():
+        init_db()
+
+    n_customers = max(sales // 8, 50)
+    customers = []
+    for cid in range(1, n_customers + 1):
+        name = f'{rng.choice(FIRST)} {rng.choice(LAST)}'
+        phone = f'9{rng.randrange(10**8, 10**9):09d}'
+        email = f'{name.split()[0].lower()}{cid}@example.com' if rng.random() < 0.3 else None
+        customers.append((cid, name, phone, email))
+
+    vehicles, owned = [], {}
+    for cid in range(1, n_customers + 1):
+        for _ in range(1 if rng.random() < 0.8 else 2):
+            vid = len(vehicles) + 1
+            vehicles.append((vid, _reg_no(vid), rng.choice(MODELS), cid))
+            owned.setdefault(cid, []).append(vid)
+
+    sale_rows, item_rows, appt_rows, pay_rows = [], [], [], []
+    hours = list(range(24))
+    for sid in range(1, sales + 1):
+        day = start + timedelta(days=int(rng.random() * days))
+        ts = day + timedelta(hours=rng.choices(hours, HOUR_WEIGHTS)[0], minutes=rng.randrange(60), seconds=rng.randrange(60))
+        if rng.random() < 0.1:
+            cid = vid = None  # walk-in
+        else:
+            cid = rng.randrange(1, n_customers + 1)
+            vid = rng.choice(owned[cid])
+        total = 0.0
+        lines = rng.sample(range(1, len(SERVICES) + 1), rng.choice([1, 1, 1, 2, 2, 3]))
+        for svc in lines:
+            qty = 1 if rng.random() < 0.95 else 2
+            price = SERVICES[svc - 1][1]
+            item_rows.append((len(item_rows) + 1, sid, svc, qty, price, price * qty))
+            total += price * qty
+        method = rng.choice(METHODS)
+        sale_rows.append((sid, cid, vid, total, 1, method, ts))
+        if vid and rng.random() < 0.3:
+            appt_id = len(appt_rows) + 1
+            appt_rows.append((appt_id, vid, lines[0], ts, 'done', 1))
+            pay_rows.append((len(pay_rows) + 1, appt_id, total, method, ts))
+
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=OFF')
+        with conn:
+            conn.execute('DELETE FROM service')
+            _insert(conn, 'INSERT INTO service (id, name, price) VALUES (?, ?, ?)', [(i + 1, n, p) for i, (n, p) in enumerate(SERVICES)])
+            _insert(conn, 'INSERT INTO customer (id, name, phone, email) VALUES (?, ?, ?, ?)', customers)
+            _insert(conn, 'INSERT INTO vehicle (id, reg_no, model, customer_id) VALUES (?, ?, ?, ?)', vehicles)
+            _insert(conn, 'INSERT INTO sale (id, customer_id, vehicle_id, total, paid, method, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    [r[:6] + (_ts(r[6]),) for r in sale_rows])
+            _insert(conn, 'INSERT INTO sale_item (id, sale_id, service_id, qty, price, line_total) VALUES (?, ?, ?, ?, ?, ?)', item_rows)
+            _insert(conn, 'INSERT INTO appointment (id, vehicle_id, service_id, scheduled_at, status, paid) VALUES (?, ?, ?, ?, ?, ?)',
+                    [r[:3] + (_ts(r[3]),) + r[4:] for r in appt_rows])
+            _insert(conn, 'INSERT INTO payment (id, appointment_id, amount, method, timestamp) VALUES (?, ?, ?, ?, ?)',
+                    [r[:4] + (_ts(r[4]),) for r in pay_rows])
+        conn.execute('ANALYZE')
+    finally:
+        conn.close()
+
+    with app.app_context():
+        rebuild_sales_rollup()
+
+    return {'services': len(SERVICES), 'customers': len(customers), 'vehicles': len(vehicles), 'sales': len(sale_rows),
+            'sale_items': len(item_rows), 'appointments': len(appt_rows), 'payments': len(pay_rows)}
@@ -0,0 +1,229 @@
+"""Drive the API through the Flask test client and collect per-endpoint numbers.
+
+For each endpoint: latency percentiles (ms), throughput (requests/s), SQL
+statements per request, the peak Python allocation of a single request
+(tracemalloc, measured in an extra untimed request), and the process's peak
+RSS so far. The RSS figure is a high-water mark for the whole run up to that
+endpoint, not a per-endpoint number.
+
+Requests run against a scratch copy of the database (and its archive), so
+write endpoints such as POST /api/sales leave the benchmark data unchanged
+and repeated runs measure the same data set.
+"""
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_mb():
+    if resource is None:
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset / 2**20
+        except (ImportError, AttributeError):
+            return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if platform.system() == 'Darwin' else rss / 1024  # bytes on macOS, KiB elsewhere
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def build_endpoints(app_module, iterations, heavy_iterations):
+    """(name, method, path, json body or None, iterations, reset caches before each request)."""
+    conn = sqlite3.connect(app_module.DB_PATH)
+    try:
+        last_day = (conn.execute('SELECT max(timestamp) FROM sale').fetchone()[0] or datetime.utcnow().isoformat())[:10]
+        first_day = (conn.execute('SELECT min(timestamp) FROM sale').fetchone()[0] or last_day)[:10]
+        name = conn.execute('SELECT name FROM customer ORDER BY id LIMIT 1').fetchone()
+        reg = conn.execute('SELECT reg_no FROM vehicle ORDER BY id LIMIT 1').fetchone()
+        svc = conn.execute('SELECT id FROM service ORDER BY id LIMIT 1').fetchone()
+    finally:
+        conn.close()
+    prefix = (name[0] if name else 'a')[:3]
+    reg_prefix = (reg[0] if reg else 'MH')[:4]
+    sale_body = {'customer': {'name': 'Bench Customer', 'phone': '9000000000'},
+                 'items': [{'service_id': svc[0] if svc else 1, 'qty': 1}], 'method': 'cash'}
+    n, h = iterations, heavy_iterations
+    return [
+        ('GET /api/services', 'GET', '/api/services', None, n, False),
+        ('GET /api/services (cold cache)', 'GET', '/api/services', None, n, True),
+        ('GET /api/customers?limit=500', 'GET', '/api/customers?limit=500', None, n, False),
+        ('GET /api/vehicles?limit=500', 'GET', '/api/vehicles?limit=500', None, n, False),
+        ('GET /api/sales', 'GET', '/api/sales', None, n, False),
+        ('GET /api/sales?limit=50&method=cash', 'GET', '/api/sales?limit=50&method=cash', None, n, False),
+        ('GET /api/sales?from=&to= (one day)', 'GET', f'/api/sales?from={last_day}&to={last_day}', None, n, False),
+        ('GET /api/sync (snapshot)', 'GET', '/api/sync', None, h, False),
+        ('GET /api/search (name)', 'GET', f'/api/search?q={prefix}', None, n, False),
+        ('GET /api/search (reg_no)', 'GET', f'/api/search?q={reg_prefix}', None, n, False),
+        ('GET /api/reports/daily', 'GET', f'/api/reports/daily?date={last_day}', None, n, False),
+        ('GET /api/reports/range (month)', 'GET', f'/api/reports/range?from={first_day}&to={last_day}&group=month', None, n, False),
+        ('GET /api/dashboard/metrics (cold cache)', 'GET', '/api/dashboard/metrics', None, n, True),
+        ('GET /dashboard', 'GET', '/dashboard', None, n, False),
+        ('GET /dashboard (cold cache)', 'GET', '/dashboard', None, n, True),
+        ('POST /api/sales', 'POST', '/api/sales', sale_body, n, False),
+        ('GET /export/all.zip', 'GET', '/export/all.zip', None, h, False),
+        ('GET /export/all.xlsx', 'GET', '/export/all.xlsx', None, h, False),
+    ]
+
+
+def copy_database(src, dst):
+    """Consistent copy of an SQLite file (including any WAL content) through the backup API."""
+    source, target = sqlite3.connect(src), sqlite3.connect(dst)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+def reset_caches(app_module):
+    app_module.invalidate_tables(list(app_module.SYNC_TABLES))
+
+
+def run(db_path, iterations=50, heavy_iterations=3, threads=1, only=None):
+    """Benchmark every endpoint against a scratch copy of db_path; returns the result dict."""
+    scratch = tempfile.mkdtemp(prefix='carwash-bench-')
+    try:
+        return _run(db_path, scratch, iterations, heavy_iterations, threads, only)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def _run(db_path, scratch, iterations, heavy_iterations, threads, only):
+    work_db = os.path.join(scratch, 'carwash.db')
+    copy_database(db_path, work_db)
+    archive = os.getenv('CARWASH_ARCHIVE_PATH') or os.path.join(os.path.dirname(os.path.abspath(db_path)), 'carwash_archive.db')
+    work_archive = os.path.join(scratch, 'carwash_archive.db')
+    if os.path.exists(archive):
+        copy_database(archive, work_archive)
+    os.environ['CARWASH_DB_PATH'] = work_db
+    os.environ['CARWASH_ARCHIVE_PATH'] = work_archive
+    import app as app_module
+    from sqlalchemy import event
+
+    flask_app = app_module.app
+    stmt_count = [0]
+    lock = threading.Lock()
+
+    def count_statement(*args):
+        with lock:
+            stmt_count[0] += 1
+
+    with flask_app.app_context():
+        app_module.init_db()
+        event.listen(app_module.db.engine, 'before_cursor_execute', count_statement)
+        counts = {t: app_module.db.session.execute(app_module.db.text(f'SELECT count(*) FROM {t}')).scalar()
+                  for t in ('customer', 'vehicle', 'sale', 'sale_item', 'appointment', 'payment')}
+
+    results = {}
+    for name, method, path, body, n, cold in build_endpoints(app_module, iterations, heavy_iterations):
+        if only and not any(o in name for o in only):
+            continue
+
+        def one_request(_):
+            if cold:
+                reset_caches(app_module)
+            client = flask_app.test_client()
+            t0 = time.perf_counter()
+            resp = client.open(path, method=method, json=body)
+            resp.get_data()  # drain streamed responses
+            elapsed = time.perf_counter() - t0
+            resp.close()
+            return elapsed, resp.status_code
+
+        one_request(None)  # warm-up
+        stmt_count[0] = 0
+        t_start = time.perf_counter()
+        if threads > 1:
+            with ThreadPoolExecutor(threads) as pool:
+                samples = list(pool.map(one_request, range(n)))
+        else:
+            samples = [one_request(i) for i in range(n)]
+        wall = time.perf_counter() - t_start
+        statements = stmt_count[0]
+
+        tracemalloc.start()
+        one_request(None)
+        alloc_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        lat = sorted(s[0] * 1000 for s in samples)
+        statuses = {}
+        for _, code in samples:
+            statuses[str(code)] = statuses.get(str(code), 0) + 1
+        results[name] = {
+            'requests': n,
+            'p50_ms': round(percentile(lat, 50), 3),
+            'p95_ms': round(percentile(lat, 95), 3),
+            'p99_ms': round(percentile(lat, 99), 3),
+            'mean_ms': round(sum(lat) / len(lat), 3),
+            'throughput_rps': round(n / wall, 2) if wall else None,
+            'sql_per_request': round(statements / n, 2),
+            'process_peak_rss_mb': round(peak_rss_mb(), 1) if peak_rss_mb() is not None else None,
+            'alloc_peak_mb': round(alloc_peak / 2**20, 2),
+            'status': statuses,
+        }
+        print(f"{name:45s} p50 {results[name]['p50_ms']:9.2f} ms  p95 {results[name]['p95_ms']:9.2f} ms  "
+              f"p99 {results[name]['p99_ms']:9.2f} ms  {results[name]['sql_per_request']:7.1f} sql/req")
+
+    with flask_app.app_context():
+        app_module.db.engine.dispose()  # release the scratch files before they are removed
+
+    return {
+        'meta': {
+            'db_path': os.path.abspath(db_path),
+            'rows': counts,
+            'iterations': iterations,
+            'heavy_iterations': heavy_iterations,
+            'threads': threads,
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'started_at': datetime.utcnow().isoformat(),
+        },
+        'endpoints': results,
+    }
+
+
+def write_results(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def compare(old_path, new_path, metric='p95_ms', threshold=1.2):
+    """Print per-endpoint ratios; returns the endpoints whose metric grew by more than threshold."""
+    with open(old_path) as f:
+        old = json.load(f)['endpoints']
+    with open(new_path) as f:
+        new = json.load(f)['endpoints']
+    regressions = []
+    for name in sorted(set(old) & set(new)):
+        a, b = old[name].get(metric), new[name].get(metric)
+        if not a or b is None:
+            continue
+        ratio = b / a
+        flag = ''
+        if ratio > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f'{name:45s} {a:10.2f} -> {b:10.2f} {metric}  x{ratio:5.2f}{flag}')
+    return regressions
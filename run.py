@@ -1,15 +1,119 @@
 #!/usr/bin/env python
 """
 Simple script to run the Car Wash POS application
+
+    python run.py                    # development server (FLASK_DEBUG=true for debug mode)
+    python run.py --production       # production WSGI server, see serve_production()
+    python run.py --startup-report   # how long imports and init_db take
 """
-from app import app, init_db
+import os
+import sys
+import time
 
-if __name__ == '__main__':
-    # Initialize database
+
+def init_database(app, init_db):
+    with app.app_context():
+        init_db()
+        # don't let server workers inherit the connections used for setup
+        from app import db
+        db.engine.dispose()
+
+
+def serve_production(host, port):
+    """Serve with waitress (threads) or gunicorn (pre-forked processes).
+
+    Environment:
+      CARWASH_SERVER   auto (default), waitress or gunicorn
+      CARWASH_WORKERS  gunicorn worker processes (default: min(4, CPUs))
+      CARWASH_THREADS  threads per process (default 8, plus one per live event
+                       stream allowed by CARWASH_EVENTS_MAX_CLIENTS)
+    The schema is initialised once here, before any worker starts, and
+    gunicorn preloads the app so workers fork from the initialised master.
+    """
+    from app import app, init_db, EVENTS_MAX_CLIENTS
+    server = os.getenv('CARWASH_SERVER', 'auto').lower()
+    threads = int(os.getenv('CARWASH_THREADS', 8 + EVENTS_MAX_CLIENTS))  # each open /api/events stream holds a thread
+    workers = int(os.getenv('CARWASH_WORKERS', min(4, os.cpu_count() or 1)))
+    if server == 'auto':
+        server = 'gunicorn' if os.name != 'nt' and _installed('gunicorn') else 'waitress'
+
+    init_database(app, init_db)
+    print(f'Starting {server} on http://{host}:{port}')
+
+    if server == 'waitress':
+        try:
+            from waitress import serve
+        except ImportError:
+            sys.exit('waitress is not installed: pip install waitress')
+        serve(app, host=host, port=port, threads=threads)
+    elif server == 'gunicorn':
+        try:
+            from gunicorn.app.base import BaseApplication
+        except ImportError:
+            sys.exit('gunicorn is not installed: pip install gunicorn')
+
+        class Server(BaseApplication):
+            def load_config(self):
+                self.cfg.set('bind', f'{host}:{port}')
+                self.cfg.set('workers', workers)
+                self.cfg.set('threads', threads)
+                self.cfg.set('worker_class', 'gthread')
+                self.cfg.set('preload_app', True)
+                self.cfg.set('timeout', int(os.getenv('CARWASH_TIMEOUT', 120)))
+
+            def load(self):
+                return app
+
+        Server().run()
+    else:
+        sys.exit(f'unknown CARWASH_SERVER: {server}')
+
+
+def _installed(module):
+    import importlib.util
+    return importlib.util.find_spec(module) is not None
+
+
+def startup_report(top=15):
+    """Print import and init_db timings, plus the slowest imports (python -X importtime)."""
+    import subprocess
+    t0 = time.perf_counter()
+    from app import app, init_db
+    t1 = time.perf_counter()
     with app.app_context():
         init_db()
-    
-    # Run the application
-    # Access at http://localhost:5000 or http://0.0.0.0:5000
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    t2 = time.perf_counter()
+    print(f'import app: {(t1 - t0) * 1000:8.1f} ms')
+    print(f'init_db:    {(t2 - t1) * 1000:8.1f} ms')
+
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                          capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = [p.strip() for p in line[len('import time:'):].split('|')]
+        rows.append((int(cumulative_us), int(self_us), name))
+    print('\nslowest imports (cumulative ms, self ms):')
+    for cumulative_us, self_us, name in sorted(rows, reverse=True)[:top]:
+        print(f'  {cumulative_us / 1000:8.1f} {self_us / 1000:8.1f}  {name}')
+
+
+if __name__ == '__main__':
+    host = os.getenv('FLASK_HOST', '0.0.0.0')
+    port = int(os.getenv('FLASK_PORT', 5000))
+
+    if '--startup-report' in sys.argv:
+        startup_report()
+    elif '--production' in sys.argv:
+        serve_production(host, port)
+    else:
+        from app import app, init_db
+        # Initialize database
+        with app.app_context():
+            init_db()
 
+        # Run the application
+        # Access at http://localhost:5000 or http://0.0.0.0:5000
+        debug = os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
+        app.run(host=host, port=port, debug=debug)
@@ -0,0 +1,13 @@
+"""WSGI entry point for external servers, e.g.
+
+    gunicorn --preload -w 4 --threads 8 -k gthread -b 0.0.0.0:5000 wsgi:app
+    waitress-serve --host=0.0.0.0 --port=5000 --threads=8 wsgi:app
+
+Use --preload with gunicorn so the schema is initialised once in the master
+process before the workers fork.
+"""
+from app import app, db, init_db
+
+with app.app_context():
+    init_db()
+    db.engine.dispose()